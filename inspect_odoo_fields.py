@@ -2,11 +2,32 @@
 """
 Odoo Fields Inspector
 Verifica qué campos están disponibles en el modelo hr.salary.rule
+y genera archivos de esquema para odoo_payroll_extractor_improved.py
 """
 
 import xmlrpc.client
 import argparse
+import json
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+# Modelos que lee odoo_payroll_extractor_improved.py
+EXTRACTOR_MODELS = [
+    'hr.salary.rule',
+    'hr.salary.rule.category',
+    'hr.payroll.structure',
+    'hr.payroll.structure.type',
+    'hr.rule.parameter',
+    'hr.rule.parameter.value',
+    'hr.payslip.input.type',
+    'hr.salary.rule.input',
+]
+
+# Atributos guardados por campo en el archivo de esquema
+SCHEMA_ATTRIBUTES = ['string', 'type', 'required', 'readonly', 'relation']
 
 
 def connect_odoo(url, db, username, password):
@@ -40,19 +61,161 @@ def get_model_fields(models, db, uid, password, model_name='hr.salary.rule'):
         return {}
 
 
+def model_exists(models, db, uid, password, model_name):
+    """Check in ir.model whether a model is installed on the server."""
+    return bool(models.execute_kw(
+        db, uid, password,
+        'ir.model', 'search_count',
+        [[('model', '=', model_name)]]
+    ))
+
+
+def get_models_fields(url, db, uid, password, model_names, workers=4):
+    """Get the fields of several models concurrently with one authenticated uid.
+
+    Returns:
+        dict: {model: fields_get result}, with None for models that do not
+              exist on the server.
+
+    Raises:
+        Exception: fields_get failed on an installed model (e.g. access
+                   rights); such models are not reported as missing.
+    """
+    # Un ServerProxy por hilo: no es seguro compartirlo entre hilos
+    local = threading.local()
+
+    def fetch(model_name):
+        if not hasattr(local, 'models'):
+            local.models = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/object')
+        try:
+            return local.models.execute_kw(
+                db, uid, password,
+                model_name, 'fields_get',
+                [],
+                {'attributes': SCHEMA_ATTRIBUTES}
+            )
+        except xmlrpc.client.Fault as e:
+            # Solo se marca como ausente si ir.model confirma que no existe
+            if model_exists(local.models, db, uid, password, model_name):
+                raise Exception(f"Could not read fields of {model_name}: {e.faultString}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(model_names)))) as executor:
+        results = executor.map(fetch, model_names)
+    return dict(zip(model_names, results))
+
+
+def write_schema_file(path, url, db, models_fields):
+    """Write a machine-readable schema file (JSON)."""
+    schema = {
+        'url': url,
+        'db': db,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'models': {
+            model: None if fields is None else {
+                name: {attr: data.get(attr) for attr in SCHEMA_ATTRIBUTES if attr in data}
+                for name, data in sorted(fields.items())
+            }
+            for model, fields in models_fields.items()
+        },
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(schema, f, indent=2, sort_keys=True)
+
+
+def load_schema_file(path):
+    """Load a schema file written by write_schema_file."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def diff_schemas(old, new):
+    """Compare two schema files.
+
+    Returns:
+        list: (model, change) tuples describing missing models, added or
+              removed fields and changed field types/relations.
+    """
+    changes = []
+    old_models = old.get('models', {})
+    new_models = new.get('models', {})
+    for model in sorted(set(old_models) | set(new_models)):
+        old_fields = old_models.get(model)
+        new_fields = new_models.get(model)
+        if old_fields is None and new_fields is None:
+            continue
+        if old_fields is None:
+            changes.append((model, "+ model"))
+            continue
+        if new_fields is None:
+            changes.append((model, "- model"))
+            continue
+        for name in sorted(set(old_fields) | set(new_fields)):
+            if name not in new_fields:
+                changes.append((model, f"- {name} ({old_fields[name].get('type')})"))
+            elif name not in old_fields:
+                changes.append((model, f"+ {name} ({new_fields[name].get('type')})"))
+            else:
+                for attr in ('type', 'relation', 'required'):
+                    before = old_fields[name].get(attr)
+                    after = new_fields[name].get(attr)
+                    if before != after:
+                        changes.append((model, f"~ {name}: {attr} {before} -> {after}"))
+    return changes
+
+
+def print_schema_diff(old_path, new_path):
+    """Print the differences between two schema files (no server round trips)."""
+    old = load_schema_file(old_path)
+    new = load_schema_file(new_path)
+    changes = diff_schemas(old, new)
+
+    print("=" * 70)
+    print(f"SCHEMA DIFF: {old.get('url', old_path)} ({old.get('db', '')}) -> "
+          f"{new.get('url', new_path)} ({new.get('db', '')})")
+    print("=" * 70)
+    if not changes:
+        print("No differences found.")
+        return
+    current = None
+    for model, change in changes:
+        if model != current:
+            print(f"\n{model}:")
+            current = model
+        print(f"  {change}")
+    print(f"\nTotal changes: {len(changes)}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Inspect available fields in Odoo hr.salary.rule model'
     )
-    parser.add_argument('--url', required=True, help='Odoo server URL')
-    parser.add_argument('--db', required=True, help='Database name')
-    parser.add_argument('--user', required=True, help='Username')
-    parser.add_argument('--password', required=True, help='Password or API key')
+    parser.add_argument('--url', help='Odoo server URL')
+    parser.add_argument('--db', help='Database name')
+    parser.add_argument('--user', help='Username')
+    parser.add_argument('--password', help='Password or API key')
     parser.add_argument('--model', default='hr.salary.rule', help='Model to inspect')
     parser.add_argument('--export', action='store_true', help='Export field names for script')
+    parser.add_argument('--models', nargs='*', default=None,
+                        help='Inspect several models at once (default: every model read by the extractor)')
+    parser.add_argument('--schema-out', default=None,
+                        help='Write the schema of the inspected models to this JSON file')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Concurrent fields_get requests in multi-model mode (default: 4)')
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two schema files offline and exit')
 
     args = parser.parse_args()
 
+    if args.diff:
+        print_schema_diff(*args.diff)
+        sys.exit(0)
+
+    missing = [opt for opt in ('url', 'db', 'user', 'password') if not getattr(args, opt)]
+    if missing:
+        parser.error("the following arguments are required: " +
+                     ', '.join(f"--{opt}" for opt in missing))
+
     print(f"Connecting to Odoo at {args.url}...")
     try:
         uid, models = connect_odoo(args.url, args.db, args.user, args.password)
@@ -61,6 +224,30 @@ def main():
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+    # Modo multi-modelo: un fields_get por modelo, en paralelo
+    if args.models is not None or args.schema_out:
+        model_names = args.models or EXTRACTOR_MODELS
+        print(f"Inspecting {len(model_names)} models...\n")
+        try:
+            models_fields = get_models_fields(args.url, args.db, uid, args.password,
+                                              model_names, args.workers)
+        except Exception as e:
+            # No escribir un esquema incompleto: el extractor omitiría esos modelos
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"{'Model':<35} {'Fields':>8}")
+        print("-" * 70)
+        for model_name, fields in models_fields.items():
+            count = 'missing' if fields is None else len(fields)
+            print(f"{model_name:<35} {count:>8}")
+        print("-" * 70)
+
+        if args.schema_out:
+            write_schema_file(args.schema_out, args.url, args.db, models_fields)
+            print(f"Schema written to: {args.schema_out}")
+        sys.exit(0)
+
     print(f"Inspecting model: {args.model}\n")
     fields_info = get_model_fields(models, args.db, uid, args.password, args.model)
 
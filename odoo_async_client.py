@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Odoo Async XML-RPC Client
+asyncio client for the Odoo XML-RPC API with the same execute_kw surface as
+xmlrpc.client.ServerProxy. Many requests are multiplexed over a small pool of
+HTTP/1.1 keep-alive connections, limited per server by a semaphore.
+"""
+
+import asyncio
+import base64
+import gzip
+import ssl
+import threading
+import xmlrpc.client
+from urllib.parse import urlsplit, unquote
+
+
+# Conexiones simultáneas por servidor (y por lo tanto peticiones en curso)
+DEFAULT_MAX_CONNECTIONS = 4
+
+USER_AGENT = 'odoo-payroll-extractor-async/1.0'
+
+
+class StaleConnection(Exception):
+    """The server closed a keep-alive connection before answering."""
+
+
+class _Connection:
+    """An open HTTP connection of the pool."""
+
+    __slots__ = ('reader', 'writer')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncOdooClient:
+    """asyncio XML-RPC client for one Odoo server.
+
+    Every coroutine may be awaited concurrently: at most max_connections
+    requests are in flight, each one on its own pooled connection. Use one
+    client per server; databases (tenants) of the same server share it, since
+    db is an argument of every call.
+    """
+
+    def __init__(self, url, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.path = parts.path.rstrip('/')
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        host_header = self.host if parts.port is None else f"{self.host}:{self.port}"
+        self._headers = (
+            f"Host: {host_header}\r\n"
+            f"User-Agent: {USER_AGENT}\r\n"
+            "Content-Type: text/xml\r\n"
+        )
+        if parts.username:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            token = base64.b64encode(credentials.encode()).decode('ascii')
+            self._headers += f"Authorization: Basic {token}\r\n"
+
+        # El semáforo se crea en el primer uso, dentro del event loop
+        self._semaphore = None
+        self._idle = []
+
+    async def call(self, service, method, *params):
+        """Call method of an XML-RPC service (common, object, db)."""
+        body = xmlrpc.client.dumps(params, method).encode('utf-8')
+        path = f"{self.path}/xmlrpc/2/{service}"
+        if self.timeout:
+            data = await asyncio.wait_for(self._request(path, body), self.timeout)
+        else:
+            data = await self._request(path, body)
+        # loads levanta xmlrpc.client.Fault si el servidor devolvió un error
+        result, _method = xmlrpc.client.loads(data)
+        return result[0]
+
+    async def authenticate(self, db, username, password):
+        """Return the uid of the user (False if the credentials are wrong)."""
+        return await self.call('common', 'authenticate', db, username, password, {})
+
+    async def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        """Async equivalent of ServerProxy('/xmlrpc/2/object').execute_kw."""
+        params = (db, uid, password, model, method, args)
+        if kwargs is not None:
+            params += (kwargs,)
+        return await self.call('object', 'execute_kw', *params)
+
+    async def close(self):
+        """Close the idle connections of the pool."""
+        while self._idle:
+            conn = self._idle.pop()
+            conn.close()
+            try:
+                await conn.writer.wait_closed()
+            except OSError:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, path, body):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                try:
+                    return await self._roundtrip(conn, path, body)
+                except (StaleConnection, ConnectionError):
+                    # Conexión keep-alive cerrada por el servidor: reintentar una vez
+                    conn.close()
+            conn = await self._open()
+            return await self._roundtrip(conn, path, body)
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        return _Connection(reader, writer)
+
+    async def _roundtrip(self, conn, path, body):
+        """Send one request on conn and return the response body."""
+        try:
+            conn.writer.write(
+                f"POST {path} HTTP/1.1\r\n{self._headers}"
+                f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+            )
+            await conn.writer.drain()
+
+            status_line = await conn.reader.readline()
+            if not status_line:
+                raise StaleConnection()
+            version, status, reason = self._parse_status(status_line)
+            headers = await self._read_headers(conn.reader)
+            data, keep_alive = await self._read_body(conn.reader, version, headers)
+        except BaseException:
+            conn.close()
+            raise
+
+        if keep_alive:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+        if status != 200:
+            raise xmlrpc.client.ProtocolError(f"{self.host}:{self.port}{path}",
+                                              status, reason, headers)
+        if headers.get('content-encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return data
+
+    @staticmethod
+    def _parse_status(line):
+        parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise xmlrpc.client.ProtocolError('', 0, f"Invalid status line: {line!r}", {})
+        return parts[0], int(parts[1]), parts[2] if len(parts) > 2 else ''
+
+    @staticmethod
+    async def _read_headers(reader):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _sep, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    @staticmethod
+    async def _read_body(reader, version, headers):
+        """Read the body and tell whether the connection can be reused."""
+        connection = headers.get('connection', '').lower()
+        keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                      else connection == 'keep-alive')
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Trailers opcionales hasta la línea vacía
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return b''.join(chunks), keep_alive
+
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length'])), keep_alive
+
+        # Sin longitud: el cuerpo termina al cerrar la conexión
+        return await reader.read(), False
+
+
+class OdooClientProxy:
+    """Blocking, thread-safe facade over AsyncOdooClient.
+
+    Runs the client on an event loop in a background thread, so it can be
+    passed as the `models` proxy of the extractor functions and shared by
+    several threads: their calls are multiplexed over the same pool.
+    """
+
+    # fetch_partitioned puede compartir este proxy entre sus hilos
+    thread_safe = True
+
+    def __init__(self, url, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+        self.client = AsyncOdooClient(url, max_connections=max_connections, timeout=timeout)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='odoo-async-client', daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def authenticate(self, db, username, password, user_agent_env=None):
+        return self._run(self.client.authenticate(db, username, password))
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        return self._run(self.client.execute_kw(db, uid, password, model, method, args, kwargs))
+
+    def close(self):
+        """Close the pool and stop the background event loop."""
+        if self._loop.is_closed():
+            return
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def connect_async(url, db, username, password,
+                        max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+    """Authenticate and return (uid, AsyncOdooClient)."""
+    client = AsyncOdooClient(url, max_connections=max_connections, timeout=timeout)
+    try:
+        uid = await client.authenticate(db, username, password)
+        if not uid:
+            raise Exception("Authentication failed. Check credentials.")
+    except BaseException:
+        await client.close()
+        raise
+    return uid, client
+
+
+def connect(url, db, username, password, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=None):
+    """Authenticate and return (uid, OdooClientProxy), like connect_odoo."""
+    proxy = OdooClientProxy(url, max_connections=max_connections, timeout=timeout)
+    try:
+        uid = proxy.authenticate(db, username, password)
+        if not uid:
+            raise Exception("Authentication failed. Check credentials.")
+    except BaseException:
+        proxy.close()
+        raise
+    return uid, proxy
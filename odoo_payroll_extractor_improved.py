@@ -8,14 +8,230 @@ import xmlrpc.client
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import argparse
+import ast
+import atexit
+import bisect
+import io
+import json
+import os
 import sys
 import re
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Modelos consultados por el modo --watch para detectar cambios
+WATCHED_MODELS = [
+    'hr.salary.rule',
+    'hr.rule.parameter',
+    'hr.rule.parameter.value',
+    'hr.payslip.input.type',
+]
+
+# Registros por particion en las lecturas paralelas (--partition-size)
+DEFAULT_PARTITION_SIZE = 2000
+
+# Tamaño aproximado en bytes de cada registro en el XML exportado
+# (usado por --catalogue para estimar el tamaño de cada archivo)
+EST_HEADER_BYTES = 200
+EST_RULE_BYTES = 800
+EST_PARAMETER_BYTES = 250
+EST_PARAMETER_VALUE_BYTES = 330
+EST_INPUT_BYTES = 250
+
+# Umbrales del planificador de extracción (--plan-only)
+PLAN_SAMPLE_SIZE = 50
+PARALLEL_VALUES_THRESHOLD = 10000
+VALUES_PER_WORKER = 10000
+MAX_PLAN_WORKERS = 8
+HEAVY_FIELDS_THRESHOLD = 5 * 1024 * 1024
+STREAM_OUTPUT_THRESHOLD = 20 * 1024 * 1024
+
+# Campos exportados de hr.payroll.structure.type con --include-dependencies
+STRUCTURE_TYPE_FIELDS = ['name', 'wage_type', 'default_schedule_pay']
+
+# Campos de texto de hr.salary.rule que pueden separarse en una segunda lectura
+HEAVY_RULE_FIELDS = ['condition_python', 'amount_python_compute', 'note']
+
+# Registros por archivo de datos en la salida como módulo (--shard-size)
+DEFAULT_SHARD_SIZE = 500
+
+# Hilos que escriben los archivos de datos del módulo (--write-workers)
+DEFAULT_WRITE_WORKERS = 4
+
+# Orden de carga de los archivos de datos del módulo: (modelo, prefijo de archivo)
+MODULE_LOAD_ORDER = [
+    ('hr.salary.rule.category', 'hr_salary_rule_category'),
+    ('hr.payroll.structure.type', 'hr_payroll_structure_type'),
+    ('hr.payroll.structure', 'hr_payroll_structure'),
+    ('hr.rule.parameter', 'hr_rule_parameter'),
+    ('hr.payslip.input.type', 'hr_payslip_input_type'),
+    ('hr.salary.rule', 'hr_salary_rule'),
+]
+
+# Logger del flujo de eventos JSON-lines (--events-file)
+EVENT_LOGGER = logging.getLogger('payroll_extractor.events')
+_EVENTS_ENABLED = False
+_LOG_LISTENER = None
+
+# Campos validados para Odoo 18 hr.salary.rule
+# Nota: struct_id es many2one (una sola estructura por regla)
+SALARY_RULE_FIELDS = [
+    'id', 'name', 'code', 'sequence', 'category_id',
+    'condition_select', 'condition_python', 'condition_range',
+    'condition_range_min', 'condition_range_max',
+    'amount_select', 'amount_fix', 'amount_percentage',
+    'amount_python_compute', 'amount_percentage_base',
+    'quantity', 'appears_on_payslip', 'active',
+    'note', 'struct_id'
+]
+
+# Campos many2one: en los registros compactos se guarda solo el id
+MANY2ONE_FIELDS = frozenset([
+    'category_id', 'parent_id', 'struct_id', 'rule_parameter_id',
+    'country_id', 'input_id', 'type_id',
+])
+
+# Campos selection cuyos valores se internan (pocos valores distintos)
+SELECTION_FIELDS = frozenset(['condition_select', 'amount_select'])
+
+
+class DependencyError(Exception):
+    """A record required by --include-dependencies cannot be exported."""
+
+
+class CompactRecord:
+    """Slotted record with the read-only dict interface used by create_xml_output.
+
+    Fields not returned by the server are left unset, so `field in record`
+    and `record.get(field)` behave like on the original search_read dict.
+    """
+
+    __slots__ = ()
+    _fieldset = frozenset()
+
+    def get(self, key, default=None):
+        if key not in self._fieldset:
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        if key not in self._fieldset:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._fieldset and hasattr(self, key)
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.keys())
+        return f"{type(self).__name__}({values})"
+
+
+def make_record_class(name, fields):
+    """Create a CompactRecord subclass with one slot per field."""
+    return type(name, (CompactRecord,), {
+        '__slots__': tuple(fields),
+        '_fieldset': frozenset(fields),
+    })
+
+
+SalaryRuleCategory = make_record_class('SalaryRuleCategory', ['id', 'name', 'code', 'parent_id'])
+PayrollStructure = make_record_class('PayrollStructure', ['id', 'name', 'code', 'type_id', 'rule_ids'])
+SalaryRule = make_record_class('SalaryRule', SALARY_RULE_FIELDS)
+RuleParameter = make_record_class('RuleParameter', ['id', 'name', 'code', 'description', 'country_id'])
+RuleParameterValue = make_record_class('RuleParameterValue',
+                                       ['id', 'rule_parameter_id', 'date_from', 'parameter_value'])
+PayslipInputType = make_record_class('PayslipInputType',
+                                     ['id', 'name', 'code', 'struct_ids', 'country_id', 'input_id'])
+
+
+def compact_records(records, record_class):
+    """Convert search_read dicts into compact records.
+
+    Many2one values ([id, name]) are stored as plain ids (None when empty),
+    selection values are interned and x2many lists become tuples.
+    """
+    fieldset = record_class._fieldset
+    compacted = []
+    for rec in records:
+        obj = record_class()
+        for field, value in rec.items():
+            if field not in fieldset:
+                continue
+            if field in MANY2ONE_FIELDS:
+                if isinstance(value, list):
+                    value = value[0]
+                elif not value:
+                    value = None
+            elif field in SELECTION_FIELDS and value:
+                value = sys.intern(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            setattr(obj, field, value)
+        compacted.append(obj)
+    return compacted
+
+
+def load_schema(path):
+    """Load a schema file written by inspect_odoo_fields.py --schema-out.
+
+    Returns:
+        dict: {model: set of field names}, with None for models that do not
+              exist on the server.
+    """
+    with open(path, encoding='utf-8') as f:
+        schema = json.load(f)
+    return {
+        model: None if fields is None else set(fields)
+        for model, fields in schema.get('models', {}).items()
+    }
+
 
+def schema_fields(schema, model, fields):
+    """Keep only the fields available on the server according to the schema.
+
+    Without schema (or if the model is not described in it) the fields are
+    returned unchanged.
+    """
+    if not schema or not schema.get(model):
+        return fields
+    available = schema[model]
+    return [field for field in fields if field == 'id' or field in available]
+
+
+def schema_has_model(schema, model):
+    """Return False only if the schema says the model does not exist."""
+    return not schema or model not in schema or schema[model] is not None
+
+
+def connect_odoo(url, db, username, password, async_client=False, max_connections=None):
+    """Establish connection to Odoo via XML-RPC.
+
+    With async_client the returned proxy is an odoo_async_client.OdooClientProxy:
+    same execute_kw, but thread-safe and backed by a pool of keep-alive
+    connections (at most max_connections requests in flight).
+    """
+    if async_client:
+        from odoo_async_client import connect
+        kwargs = {'max_connections': max_connections} if max_connections else {}
+        try:
+            return connect(url, db, username, password, **kwargs)
+        except Exception as e:
+            raise Exception(f"Connection error: {e}")
 
-def connect_odoo(url, db, username, password):
-    """Establish connection to Odoo via XML-RPC."""
     common = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/common')
 
     try:
@@ -29,129 +245,299 @@ def connect_odoo(url, db, username, password):
         raise Exception(f"Connection error: {e}")
 
 
-def get_salary_rule_categories(models, db, uid, password):
+def is_thread_safe_proxy(models):
+    """Return True for proxies that can be shared between threads.
+
+    The attribute is looked up on the class: on a ServerProxy instance any
+    attribute is an RPC method object, which is always truthy.
+    """
+    return getattr(type(models), 'thread_safe', False) is True
+
+
+def fetch_partitioned(url, db, uid, password, model, domain, fields, order=None,
+                      workers=4, partition_size=DEFAULT_PARTITION_SIZE, models=None):
+    """Fetch a large model reading id partitions concurrently.
+
+    The ids are obtained with a single `search` (already sorted by `order`),
+    split into partitions of partition_size ids and read with `read` on a pool
+    of `workers` threads, each one with its own keep-alive connection. The
+    result keeps the `search` order, like an equivalent search_read.
+
+    A thread-safe models proxy (see odoo_async_client) is shared by the
+    threads instead of opening one connection per thread.
+    """
+    shared = models is not None
+    if not shared:
+        models = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/object')
+    kwargs = {'order': order} if order else {}
+    ids = models.execute_kw(db, uid, password, model, 'search', [domain], kwargs)
+    if not ids:
+        return []
+
+    partitions = [ids[i:i + partition_size] for i in range(0, len(ids), partition_size)]
+
+    # Un ServerProxy por hilo: no es seguro compartirlo entre hilos
+    local = threading.local()
+
+    def read_partition(partition):
+        if shared:
+            proxy = models
+        else:
+            if not hasattr(local, 'models'):
+                local.models = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/object')
+            proxy = local.models
+        return proxy.execute_kw(
+            db, uid, password,
+            model, 'read',
+            [partition],
+            {'fields': fields}
+        )
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(partitions))) as executor:
+        results = list(executor.map(read_partition, partitions))
+
+    # read no garantiza el orden: reordenar según el resultado de search
+    by_id = {rec['id']: rec for chunk in results for rec in chunk}
+    return [by_id[record_id] for record_id in ids if record_id in by_id]
+
+
+def get_salary_rule_categories(models, db, uid, password, schema=None):
     """Fetch all salary rule categories."""
     categories = models.execute_kw(
         db, uid, password,
         'hr.salary.rule.category', 'search_read',
         [[]],
-        {'fields': ['id', 'name', 'code', 'parent_id']}
+        {'fields': schema_fields(schema, 'hr.salary.rule.category',
+                                 ['id', 'name', 'code', 'parent_id'])}
     )
-    return {cat['id']: cat for cat in categories}
+    return {cat['id']: cat for cat in compact_records(categories, SalaryRuleCategory)}
 
 
-def get_payroll_structures(models, db, uid, password):
-    """Fetch all payroll structures."""
+def get_payroll_structures(models, db, uid, password, schema=None, include_rule_ids=False):
+    """Fetch all payroll structures.
+
+    rule_ids (the full list of rule ids of every structure) is only fetched
+    when include_rule_ids is set.
+    """
+    fields = ['id', 'name', 'code', 'type_id']
+    if include_rule_ids:
+        fields.append('rule_ids')
     try:
         structures = models.execute_kw(
             db, uid, password,
             'hr.payroll.structure', 'search_read',
             [[]],
-            {'fields': ['id', 'name', 'code', 'rule_ids']}
+            {'fields': schema_fields(schema, 'hr.payroll.structure', fields)}
         )
-        return {struct['id']: struct for struct in structures}
+        return {struct['id']: struct for struct in compact_records(structures, PayrollStructure)}
     except Exception:
         return {}
 
 
-def get_rule_parameters(models, db, uid, password):
+def get_rule_parameters(models, db, uid, password, schema=None):
     """Fetch all rule parameters (hr.rule.parameter)."""
+    if not schema_has_model(schema, 'hr.rule.parameter'):
+        logging.info("Note: hr.rule.parameter not available according to the schema file")
+        return []
     try:
         params = models.execute_kw(
             db, uid, password,
             'hr.rule.parameter', 'search_read',
             [[]],
-            {'fields': ['id', 'name', 'code', 'description', 'country_id']}
+            {'fields': schema_fields(schema, 'hr.rule.parameter',
+                                     ['id', 'name', 'code', 'description', 'country_id'])}
         )
-        return params
+        return compact_records(params, RuleParameter)
     except Exception as e:
-        print(f"Warning: Could not fetch rule parameters: {e}")
+        logging.warning("Warning: Could not fetch rule parameters: %s", e)
         return []
 
 
-def get_rule_parameter_values(models, db, uid, password, parameter_ids=None):
-    """Fetch all rule parameter values (hr.rule.parameter.value)."""
+def get_rule_parameter_values(models, db, uid, password, parameter_ids=None,
+                              url=None, workers=1, partition_size=DEFAULT_PARTITION_SIZE,
+                              schema=None, date_from_min=None):
+    """Fetch all rule parameter values (hr.rule.parameter.value).
+
+    With url and workers > 1 the values are read in parallel id partitions
+    (see fetch_partitioned) instead of a single search_read. date_from_min
+    excludes older values in the server-side domain.
+    """
+    if not schema_has_model(schema, 'hr.rule.parameter.value'):
+        logging.info("Note: hr.rule.parameter.value not available according to the schema file")
+        return []
     try:
         domain = []
         if parameter_ids:
             domain = [('rule_parameter_id', 'in', parameter_ids)]
+        if date_from_min:
+            domain.append(('date_from', '>=', date_from_min))
+
+        fields = schema_fields(schema, 'hr.rule.parameter.value',
+                               ['id', 'rule_parameter_id', 'date_from', 'parameter_value'])
+        order = 'rule_parameter_id, date_from'
+        if url and workers > 1:
+            values = fetch_partitioned(
+                url, db, uid, password,
+                'hr.rule.parameter.value', domain, fields, order=order,
+                workers=workers, partition_size=partition_size,
+                models=models if is_thread_safe_proxy(models) else None
+            )
+        else:
+            values = models.execute_kw(
+                db, uid, password,
+                'hr.rule.parameter.value', 'search_read',
+                [domain],
+                {'fields': fields, 'order': order}
+            )
+        return compact_records(values, RuleParameterValue)
+    except Exception as e:
+        logging.warning("Warning: Could not fetch rule parameter values: %s", e)
+        return []
 
-        values = models.execute_kw(
+
+def get_parameter_value_history(models, db, uid, password, as_of, parameter_ids=None):
+    """Find, per parameter, the date_from of the value in effect on as_of.
+
+    A single read_group (max date_from of the values dated up to as_of)
+    computed by the server.
+
+    Returns:
+        dict: {parameter id: (effective date_from, number of values dated up to as_of)}
+    """
+    domain = [('date_from', '<=', as_of)]
+    if parameter_ids:
+        domain.append(('rule_parameter_id', 'in', parameter_ids))
+    try:
+        groups = models.execute_kw(
             db, uid, password,
-            'hr.rule.parameter.value', 'search_read',
-            [domain],
-            {'fields': ['id', 'rule_parameter_id', 'date_from', 'parameter_value'],
-             'order': 'rule_parameter_id, date_from'}
+            'hr.rule.parameter.value', 'read_group',
+            [domain, ['date_from:max'], ['rule_parameter_id']],
+            {'lazy': False}
         )
-        return values
     except Exception as e:
-        print(f"Warning: Could not fetch rule parameter values: {e}")
-        return []
+        logging.warning("Warning: Could not group rule parameter values: %s", e)
+        return None
+    return {
+        group['rule_parameter_id'][0]: (group['date_from'], group.get('__count', 0))
+        for group in groups if group.get('rule_parameter_id')
+    }
+
 
+def select_effective_values(parameter_values, as_of, history=None):
+    """Keep, per parameter, the value in effect on as_of plus any later values.
 
-def get_salary_rule_inputs(models, db, uid, password, rule_ids=None):
+    The values arrive ordered by rule_parameter_id, date_from, so every
+    parameter gets a sorted date index and the effective value is found with
+    a binary search.
+
+    Returns:
+        tuple: (selected values, {parameter id: total number of values}) where
+               the totals also count the older values not exported (taken from
+               history, see get_parameter_value_history).
+    """
+    values_by_param = {}
+    for pval in parameter_values:
+        values_by_param.setdefault(pval['rule_parameter_id'], []).append(pval)
+
+    selected = []
+    value_counts = {}
+    for param_id, values in values_by_param.items():
+        dates = [str(pval['date_from']) for pval in values]
+        # Índice del último valor con date_from <= as_of (o el primero si todos son futuros)
+        start = max(bisect.bisect_right(dates, as_of) - 1, 0)
+        selected.extend(values[start:])
+
+        later = len(dates) - bisect.bisect_right(dates, as_of)
+        if history is not None:
+            value_counts[param_id] = history.get(param_id, (None, 0))[1] + later
+        else:
+            value_counts[param_id] = len(values)
+    return selected, value_counts
+
+
+def get_salary_rule_inputs(models, db, uid, password, rule_ids=None, schema=None):
     """Fetch salary rule inputs."""
     # En Odoo, los inputs pueden estar en diferentes modelos según la versión
     # Intentamos con hr.payslip.input.type o hr.salary.rule.input
     inputs = []
 
-    # Primero intentamos obtener los tipos de input
-    try:
-        input_types = models.execute_kw(
-            db, uid, password,
-            'hr.payslip.input.type', 'search_read',
-            [[]],
-            {'fields': ['id', 'name', 'code', 'struct_ids', 'country_id']}
-        )
-        inputs = input_types
-    except Exception as e:
-        print(f"Note: hr.payslip.input.type not available: {e}")
-
+    def fetch_alternative():
         # Intentar con modelo alternativo
+        if not schema_has_model(schema, 'hr.salary.rule.input'):
+            logging.info("Note: hr.salary.rule.input not available according to the schema file")
+            return []
         try:
-            input_types = models.execute_kw(
+            return models.execute_kw(
                 db, uid, password,
                 'hr.salary.rule.input', 'search_read',
                 [[]],
-                {'fields': ['id', 'name', 'code', 'input_id']}
+                {'fields': schema_fields(schema, 'hr.salary.rule.input',
+                                         ['id', 'name', 'code', 'input_id'])}
             )
-            inputs = input_types
         except Exception as e2:
-            print(f"Note: hr.salary.rule.input not available: {e2}")
+            logging.info("Note: hr.salary.rule.input not available: %s", e2)
+            return []
+
+    # Primero intentamos obtener los tipos de input
+    if not schema_has_model(schema, 'hr.payslip.input.type'):
+        logging.info("Note: hr.payslip.input.type not available according to the schema file")
+        inputs = fetch_alternative()
+    else:
+        try:
+            inputs = models.execute_kw(
+                db, uid, password,
+                'hr.payslip.input.type', 'search_read',
+                [[]],
+                {'fields': schema_fields(schema, 'hr.payslip.input.type',
+                                         ['id', 'name', 'code', 'struct_ids', 'country_id'])}
+            )
+        except Exception as e:
+            logging.info("Note: hr.payslip.input.type not available: %s", e)
+            inputs = fetch_alternative()
 
-    return inputs
+    return compact_records(inputs, PayslipInputType)
 
 
-def get_salary_rules(models, db, uid, password, structure_id=None):
-    """Fetch salary rules with ALL available fields."""
-    # Lista de campos validados para Odoo 18 hr.salary.rule
-    # Nota: struct_id es many2one (una sola estructura por regla)
-    fields = [
-        'id', 'name', 'code', 'sequence', 'category_id',
-        'condition_select', 'condition_python', 'condition_range',
-        'condition_range_min', 'condition_range_max',
-        'amount_select', 'amount_fix', 'amount_percentage',
-        'amount_python_compute', 'amount_percentage_base',
-        'quantity', 'appears_on_payslip', 'active',
-        'note', 'struct_id'
-    ]
+def get_salary_rules(models, db, uid, password, structure_id=None, schema=None,
+                     split_heavy_fields=False, partition_size=DEFAULT_PARTITION_SIZE):
+    """Fetch salary rules with ALL available fields.
 
+    With a schema file only the fields known to exist are requested, so the
+    basic-fields retry is not needed. With split_heavy_fields the text fields
+    (HEAVY_RULE_FIELDS) are read in a second pass, partition_size rules at a
+    time, so no single response carries the code of every rule.
+    """
     domain = []
     if structure_id:
         # Buscar reglas que pertenezcan a la estructura especificada
         domain = [('struct_id', '=', structure_id)]
 
     try:
+        fields = schema_fields(schema, 'hr.salary.rule', SALARY_RULE_FIELDS)
+        heavy_fields = [f for f in fields if f in HEAVY_RULE_FIELDS] if split_heavy_fields else []
         rules = models.execute_kw(
             db, uid, password,
             'hr.salary.rule', 'search_read',
             [domain],
-            {'fields': fields, 'order': 'sequence, id'}
+            {'fields': [f for f in fields if f not in heavy_fields],
+             'order': 'sequence, id'}
         )
-        return rules
+        if heavy_fields:
+            rules_by_id = {rule['id']: rule for rule in rules}
+            rule_ids = list(rules_by_id)
+            for i in range(0, len(rule_ids), partition_size):
+                texts = models.execute_kw(
+                    db, uid, password,
+                    'hr.salary.rule', 'read',
+                    [rule_ids[i:i + partition_size]],
+                    {'fields': heavy_fields}
+                )
+                for text in texts:
+                    rules_by_id[text['id']].update(text)
+        return compact_records(rules, SalaryRule)
     except Exception as e:
         # Si algunos campos fallan, intentar con campos básicos
-        print(f"Warning: Some fields not available, using basic fields. Error: {e}")
+        logging.warning("Warning: Some fields not available, using basic fields. Error: %s", e)
         basic_fields = [
             'id', 'name', 'code', 'sequence', 'category_id',
             'condition_select', 'condition_python',
@@ -164,7 +550,7 @@ def get_salary_rules(models, db, uid, password, structure_id=None):
             [domain],
             {'fields': basic_fields, 'order': 'sequence, id'}
         )
-        return rules
+        return compact_records(rules, SalaryRule)
 
 
 def get_external_id(models, db, uid, password, model, record_id):
@@ -187,6 +573,73 @@ def get_external_id(models, db, uid, password, model, record_id):
         return None
 
 
+def get_external_ids(models, db, uid, password, model, record_ids):
+    """Get the external IDs of several records of a model with one query.
+
+    Returns:
+        dict: {record_id: 'module.name'} for the records that have one.
+    """
+    if not record_ids:
+        return {}
+    rows = models.execute_kw(
+        db, uid, password,
+        'ir.model.data', 'search_read',
+        [[('model', '=', model), ('res_id', 'in', list(record_ids))]],
+        {'fields': ['module', 'name', 'res_id']}
+    )
+    xmlids = {}
+    for row in rows:
+        xmlids.setdefault(row['res_id'], f"{row['module']}.{row['name']}")
+    return xmlids
+
+
+def get_structure_types(models, db, uid, password, type_ids):
+    """Read the payroll structure types exported with --include-dependencies.
+
+    Raises:
+        DependencyError: a type cannot be read; the structures that use it
+                         could not be loaded without their type_id.
+    """
+    try:
+        types = models.execute_kw(
+            db, uid, password,
+            'hr.payroll.structure.type', 'read',
+            [list(type_ids)],
+            {'fields': STRUCTURE_TYPE_FIELDS}
+        )
+    except Exception as e:
+        raise DependencyError(f"Could not read payroll structure types {sorted(type_ids)}: {e}")
+    by_id = {t['id']: t for t in types}
+    missing = sorted(set(type_ids) - set(by_id))
+    if missing:
+        raise DependencyError(f"Payroll structure types not found: {missing}")
+    return by_id
+
+
+def category_closure(category_ids, categories, existing_ids=()):
+    """Return the given categories plus all their ancestors, parents first.
+
+    One pass over the in-memory categories map: each category walks up its
+    parent_id chain until it reaches an already visited category, and the new
+    part of the chain is appended top-down. The walk also stops at
+    existing_ids (categories already on the target): their ancestors exist
+    there too, so they are left out.
+    """
+    ordered = []
+    visited = set()
+    for cat_id in category_ids:
+        chain = []
+        current = cat_id
+        while current and current not in visited and current in categories:
+            visited.add(current)
+            if current in existing_ids:
+                break
+            chain.append(current)
+            current = categories[current].get('parent_id')
+        ordered.extend(reversed(chain))
+    return ordered
+
+
 def sanitize_xml_id(name, code=None, prefix=''):
     """Generate a valid XML ID from name/code."""
     base = code if code else name
@@ -228,12 +681,21 @@ def create_field_element(parent, field_name, value, **attrs):
 def create_xml_output(rules, categories, structures, models, db, uid, password,
                      generate_xmlids=True, module_prefix='l10n_do_hr_payroll',
                      rule_parameters=None, parameter_values=None, inputs=None,
-                     include_without_xmlid=False):
+                     include_without_xmlid=False, parameter_value_counts=None,
+                     include_dependencies=False):
     """Generate Odoo-compatible XML data file with proper XML IDs and all fields.
 
     Args:
         include_without_xmlid: If True, includes rules without xmlid (generates automatic xmlid).
                               If False (default), skips rules without xmlid to avoid duplicates.
+        include_dependencies: If True, also emits the categories (with their ancestors,
+                              parents first), structures and structure types referenced
+                              by the exported rules and inputs that have no xmlid in
+                              ir.model.data. Raises DependencyError if a structure type
+                              cannot be read.
+        parameter_value_counts: Total number of values of each parameter when
+                              parameter_values is only a window of the history,
+                              so generated value xmlids keep their date suffix.
 
     Returns:
         tuple: (xml_root, skipped_rules) where skipped_rules is a list of rules
@@ -242,6 +704,7 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
 
     rule_parameters = rule_parameters or []
     parameter_values = parameter_values or []
+    parameter_value_counts = parameter_value_counts or {}
     inputs = inputs or []
 
     # Mapa de XML IDs para referencias
@@ -250,16 +713,21 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
     rule_xmlids = {}
     parameter_xmlids = {}
 
+    # Categorías/estructuras con xmlid existente en ir.model.data
+    existing_category_ids = set()
+    existing_structure_ids = set()
+
     # Lista de reglas omitidas (sin xmlid)
     skipped_rules = []
 
     # Obtener XML IDs existentes si es posible
     if generate_xmlids:
-        print("Fetching existing XML IDs...")
+        logging.info("Fetching existing XML IDs...")
         for cat_id, cat in categories.items():
             ext_id = get_external_id(models, db, uid, password, 'hr.salary.rule.category', cat_id)
             if ext_id:
                 category_xmlids[cat_id] = ext_id
+                existing_category_ids.add(cat_id)
             else:
                 # Generar uno nuevo (sin prefijo de módulo)
                 xml_id = sanitize_xml_id(cat['name'], cat['code'])
@@ -269,6 +737,7 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
             ext_id = get_external_id(models, db, uid, password, 'hr.payroll.structure', struct_id)
             if ext_id:
                 structure_xmlids[struct_id] = ext_id
+                existing_structure_ids.add(struct_id)
             else:
                 xml_id = sanitize_xml_id(struct['name'], struct.get('code'))
                 structure_xmlids[struct_id] = f"aginc_structure_{xml_id}"
@@ -284,11 +753,13 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
                     xml_id = sanitize_xml_id(rule['name'], rule['code'])
                     rule_xmlids[rule['id']] = f"aginc_hr_salary_rule_{xml_id}"
                     logging.info(
-                        f"Regla sin xmlid incluida con ID generado - ID: {rule['id']}, "
-                        f"Nombre: {rule.get('name', 'N/A')}, "
-                        f"Codigo: {rule.get('code', 'N/A')}, "
-                        f"xmlid generado: aginc_hr_salary_rule_{xml_id}"
+                        "Regla sin xmlid incluida con ID generado - ID: %s, "
+                        "Nombre: %s, Codigo: %s, xmlid generado: %s",
+                        rule['id'], rule.get('name', 'N/A'), rule.get('code', 'N/A'),
+                        rule_xmlids[rule['id']]
                     )
+                    emit_event('rule_autoid', rule_id=rule['id'], code=rule.get('code'),
+                               xmlid=rule_xmlids[rule['id']])
                 else:
                     # Omitir la regla
                     skipped_rules.append({
@@ -298,10 +769,11 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
                         'reason': 'No xmlid found in ir.model.data'
                     })
                     logging.warning(
-                        f"Regla omitida - ID: {rule['id']}, "
-                        f"Nombre: {rule.get('name', 'N/A')}, "
-                        f"Codigo: {rule.get('code', 'N/A')} - Sin xmlid"
+                        "Regla omitida - ID: %s, Nombre: %s, Codigo: %s - Sin xmlid",
+                        rule['id'], rule.get('name', 'N/A'), rule.get('code', 'N/A')
                     )
+                    emit_event('rule_skipped', rule_id=rule['id'], code=rule.get('code'),
+                               name=rule.get('name'), reason='no_xmlid')
 
         # Obtener XML IDs para parámetros
         for param in rule_parameters:
@@ -321,13 +793,114 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
 
     # Create root element
     root = ET.Element('odoo')
-    
+
+    # IDs de reglas omitidas para filtrado rápido
+    skipped_rule_ids = {r['id'] for r in skipped_rules}
+
+    # =====================================================================
+    # Dependencias: categorías (padres primero) y estructuras referenciadas
+    # =====================================================================
+    if include_dependencies:
+        exported_rules = [r for r in rules if not (generate_xmlids and r['id'] in skipped_rule_ids)]
+        # Las categorías con xmlid propio ya existen en el destino con sus padres
+        on_target_categories = {c for c in existing_category_ids
+                                if not category_xmlids[c].startswith('__export__.')}
+        dependency_categories = category_closure(
+            [r['category_id'] for r in exported_rules if r.get('category_id')], categories,
+            existing_ids=on_target_categories)
+        dependency_structures = sorted(
+            {r['struct_id'] for r in exported_rules if r.get('struct_id')}
+            | {struct_id for inp in inputs for struct_id in (inp.get('struct_ids') or ())}
+        )
+
+        # Los registros emitidos y las referencias deben usar el mismo xmlid
+        for cat_id in dependency_categories:
+            if cat_id not in category_xmlids:
+                cat = categories[cat_id]
+                category_xmlids[cat_id] = f"aginc_{sanitize_xml_id(cat['name'], cat['code']).upper()}"
+        for struct_id in dependency_structures:
+            if struct_id not in structure_xmlids and struct_id in structures:
+                struct = structures[struct_id]
+                structure_xmlids[struct_id] = sanitize_xml_id(struct['name'], struct.get('code'),
+                                                              'aginc_structure')
+
+        # Solo se emiten los registros que no existen en el destino
+        def needs_record(record_id, existing_ids, xmlid):
+            return record_id not in existing_ids or xmlid.startswith('__export__.')
+
+        emitted_categories = [c for c in dependency_categories
+                              if needs_record(c, existing_category_ids, category_xmlids[c])]
+        if emitted_categories:
+            root.append(ET.Comment(' Categorías de reglas salariales (hr.salary.rule.category) '))
+        for cat_id in emitted_categories:
+            cat = categories[cat_id]
+            record = ET.SubElement(root, 'record', {
+                'id': category_xmlids[cat_id],
+                'model': 'hr.salary.rule.category'
+            })
+            create_field_element(record, 'name', cat['name'])
+            create_field_element(record, 'code', cat['code'])
+            if cat.get('parent_id') in category_xmlids:
+                ET.SubElement(record, 'field', {
+                    'name': 'parent_id',
+                    'ref': category_xmlids[cat['parent_id']]
+                })
+
+        emitted_structures = [s for s in dependency_structures
+                              if s in structures
+                              and needs_record(s, existing_structure_ids, structure_xmlids[s])]
+
+        # type_id es obligatorio en Odoo 18: los tipos sin xmlid se exportan también
+        type_ids = sorted({structures[s]['type_id'] for s in emitted_structures
+                           if structures[s].get('type_id')})
+        type_xmlids = {}
+        if generate_xmlids:
+            try:
+                type_xmlids = get_external_ids(models, db, uid, password,
+                                               'hr.payroll.structure.type', type_ids)
+            except Exception as e:
+                raise DependencyError(f"Could not look up payroll structure type xmlids: {e}")
+        emitted_types = [t for t in type_ids
+                         if needs_record(t, set(type_xmlids), type_xmlids.get(t, ''))]
+        if emitted_types:
+            structure_types = get_structure_types(models, db, uid, password, emitted_types)
+            root.append(ET.Comment(' Tipos de estructura salarial (hr.payroll.structure.type) '))
+        for type_id in emitted_types:
+            struct_type = structure_types[type_id]
+            type_xmlids.setdefault(type_id, sanitize_xml_id(struct_type['name'], None,
+                                                            'aginc_structure_type'))
+            record = ET.SubElement(root, 'record', {
+                'id': type_xmlids[type_id],
+                'model': 'hr.payroll.structure.type'
+            })
+            for field in STRUCTURE_TYPE_FIELDS:
+                if struct_type.get(field):
+                    create_field_element(record, field, struct_type[field])
+
+        if emitted_structures:
+            root.append(ET.Comment(' Estructuras salariales (hr.payroll.structure) '))
+        for struct_id in emitted_structures:
+            struct = structures[struct_id]
+            record = ET.SubElement(root, 'record', {
+                'id': structure_xmlids[struct_id],
+                'model': 'hr.payroll.structure'
+            })
+            create_field_element(record, 'name', struct['name'])
+            if struct.get('code'):
+                create_field_element(record, 'code', struct['code'])
+
+            type_id = struct.get('type_id')
+            if not type_id:
+                raise DependencyError(f"Payroll structure {struct['name']} has no type_id, "
+                                      f"required by Odoo 18")
+            ET.SubElement(record, 'field', {
+                'name': 'type_id',
+                'ref': type_xmlids[type_id]
+            })
+
     # Add comment for salary rules section
     comment = ET.Comment(' Reglas salariales para la estructura de Nomina Regular (Quincenal y con retenciones en ambas quincenas) ')
     root.append(comment)
-    
-    # IDs de reglas omitidas para filtrado rápido
-    skipped_rule_ids = {r['id'] for r in skipped_rules}
 
     # Add salary rules
     for rule in rules:
@@ -351,7 +924,7 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
         
         # Campo: category_id (con ref)
         if rule.get('category_id'):
-            cat_id = rule['category_id'][0]
+            cat_id = rule['category_id']
             if cat_id in category_xmlids:
                 ref_id = category_xmlids[cat_id]
             else:
@@ -369,7 +942,7 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
         
         # Campo: struct_id (con ref) - para compatibilidad con versiones anteriores
         if rule.get('struct_id'):
-            struct_id = rule['struct_id'][0]
+            struct_id = rule['struct_id']
             if struct_id in structure_xmlids:
                 ref_id = structure_xmlids[struct_id]
             else:
@@ -464,14 +1037,9 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
         values_by_param = {}
         for pval in parameter_values:
             param_id = pval.get('rule_parameter_id')
-            if param_id and isinstance(param_id, list):
-                param_db_id = param_id[0]
-            else:
-                param_db_id = param_id
-
-            if param_db_id not in values_by_param:
-                values_by_param[param_db_id] = []
-            values_by_param[param_db_id].append(pval)
+            if param_id not in values_by_param:
+                values_by_param[param_id] = []
+            values_by_param[param_id].append(pval)
 
         for param in rule_parameters:
             # Determinar el XML ID para este parámetro
@@ -514,7 +1082,7 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
                     # Generar XML ID para el valor (formato: aginc_rule_parameter_value_{code})
                     value_xmlid = record_xmlid.replace('aginc_rule_parameter_', 'aginc_rule_parameter_value_')
                     # Si hay múltiples valores, agregar sufijo de fecha
-                    if len(param_values) > 1:
+                    if parameter_value_counts.get(param['id'], len(param_values)) > 1:
                         date_suffix = str(pval.get('date_from', '')).replace('-', '_')
                         value_xmlid = f"{value_xmlid}_{date_suffix}" if date_suffix else f"{value_xmlid}_{idx}"
 
@@ -586,6 +1154,31 @@ def create_xml_output(rules, categories, structures, models, db, uid, password,
     return root, skipped_rules
 
 
+def write_xml_stream(elem, output_file):
+    """Write the XML tree record by record instead of pretty-printing it whole.
+
+    Each record is formatted by minidom at its nesting level, as prettify_xml
+    does for the whole tree, so the output matches write_xml_file while only
+    one record is held as a DOM at a time. Text nodes (rule code) are written
+    as they are, never re-indented.
+    """
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" ?>\n')
+        f.write(f'<{elem.tag}>\n')
+        for child in elem:
+            if child.tag is ET.Comment:
+                f.write(f'    <!--{child.text}-->\n')
+                continue
+            buffer = io.StringIO()
+            node = minidom.parseString(ET.tostring(child, encoding='unicode')).documentElement
+            node.writexml(buffer, indent='    ', addindent='    ', newl='\n')
+            # Mismo filtro de líneas vacías que prettify_xml
+            for line in buffer.getvalue().split('\n'):
+                if line.strip():
+                    f.write(line + '\n')
+        f.write(f'</{elem.tag}>')
+
+
 def prettify_xml(elem):
     """Return a pretty-printed XML string with proper formatting."""
     # Convertir a string
@@ -601,7 +1194,7 @@ def prettify_xml(elem):
         
         return '\n'.join(lines)
     except Exception as e:
-        print(f"Warning: Could not prettify XML: {e}")
+        logging.warning("Warning: Could not prettify XML: %s", e)
         return rough_string
 
 
@@ -633,21 +1226,745 @@ def list_structures(models, db, uid, password):
     print(f"Total: {len(structures)} structures")
 
 
-def setup_logging(log_file=None):
-    """Configure logging to file and console."""
-    log_filename = log_file or f"payroll_extractor_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+def count_rules_by_structure(models, db, uid, password, domain=None):
+    """Count salary rules per structure with a single read_group.
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
+    Returns:
+        dict: {struct_id: rule count}
+    """
+    groups = models.execute_kw(
+        db, uid, password,
+        'hr.salary.rule', 'read_group',
+        [domain or [], ['struct_id'], ['struct_id']],
+        {'lazy': False}
     )
+    counts = {}
+    for group in groups:
+        if group.get('struct_id'):
+            counts[group['struct_id'][0]] = group.get('__count', group.get('struct_id_count', 0))
+    return counts
+
+
+def count_records(models, db, uid, password, model):
+    """Return search_count of a model, or 0 if the model is not available."""
+    try:
+        return models.execute_kw(db, uid, password, model, 'search_count', [[]])
+    except Exception:
+        return 0
+
+
+def format_size(num_bytes):
+    """Format a byte count as a short human readable string."""
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}"
+        num_bytes /= 1024.0
+    return f"{num_bytes:.1f} GB"
+
+
+def list_structure_catalogue(models, db, uid, password):
+    """List payroll structures with rule counts and an estimated export size.
+
+    Uses read_group/search_count only: no rule is downloaded. The estimate
+    adds the rules of the structure to the shared section (parameters, their
+    values and input types) that every exported file contains.
+    """
+    structures = get_payroll_structures(models, db, uid, password)
+    if not structures:
+        print("No payroll structures found.")
+        return
+
+    rule_counts = count_rules_by_structure(models, db, uid, password)
+    # Reglas cuyo código usa rule_parameter() / _rule_parameter()
+    param_ref_counts = count_rules_by_structure(models, db, uid, password, [
+        '|',
+        ('amount_python_compute', 'ilike', 'rule_parameter'),
+        ('condition_python', 'ilike', 'rule_parameter'),
+    ])
+
+    shared_size = (
+        count_records(models, db, uid, password, 'hr.rule.parameter') * EST_PARAMETER_BYTES
+        + count_records(models, db, uid, password, 'hr.rule.parameter.value') * EST_PARAMETER_VALUE_BYTES
+        + count_records(models, db, uid, password, 'hr.payslip.input.type') * EST_INPUT_BYTES
+    )
+
+    print("\nPayroll Structure Catalogue:")
+    print("-" * 90)
+    print(f"{'ID':<6} {'Code':<20} {'Rules':>7} {'Param refs':>11} {'Est. size':>11}  {'Name'}")
+    print("-" * 90)
+    total_rules = 0
+    for struct_id, struct in sorted(structures.items()):
+        code = struct.get('code', '') or ''
+        rules = rule_counts.get(struct_id, 0)
+        total_rules += rules
+        size = format_size(EST_HEADER_BYTES + rules * EST_RULE_BYTES + shared_size)
+        print(f"{struct_id:<6} {code:<20} {rules:>7} {param_ref_counts.get(struct_id, 0):>11} "
+              f"{size:>11}  {struct.get('name', '')}")
+    print("-" * 90)
+    complete_size = format_size(EST_HEADER_BYTES + total_rules * EST_RULE_BYTES + shared_size)
+    print(f"Total: {len(structures)} structures, {total_rules} rules "
+          f"(complete export ~{complete_size})")
+
+
+def plan_extraction(models, db, uid, password, structure_id=None, sample=True):
+    """Size the extraction with cheap queries and choose the fetch strategy.
+
+    Counts every model with search_count and, if sample is set, reads the text
+    fields of up to PLAN_SAMPLE_SIZE rules to estimate their average size.
+
+    Returns:
+        dict: counts, avg_text_bytes, estimated_size and the chosen workers,
+              partition_size, split_heavy_fields and stream_output.
+    """
+    rule_domain = [('struct_id', '=', structure_id)] if structure_id else []
+    counts = {
+        'hr.salary.rule': models.execute_kw(db, uid, password, 'hr.salary.rule',
+                                            'search_count', [rule_domain]),
+        'hr.salary.rule.category': count_records(models, db, uid, password, 'hr.salary.rule.category'),
+        'hr.payroll.structure': count_records(models, db, uid, password, 'hr.payroll.structure'),
+        'hr.rule.parameter': count_records(models, db, uid, password, 'hr.rule.parameter'),
+        'hr.rule.parameter.value': count_records(models, db, uid, password, 'hr.rule.parameter.value'),
+        'hr.payslip.input.type': count_records(models, db, uid, password, 'hr.payslip.input.type'),
+    }
+
+    avg_text_bytes = None
+    if sample and counts['hr.salary.rule']:
+        try:
+            sampled = models.execute_kw(
+                db, uid, password,
+                'hr.salary.rule', 'search_read',
+                [rule_domain],
+                {'fields': HEAVY_RULE_FIELDS, 'limit': PLAN_SAMPLE_SIZE}
+            )
+            text_bytes = sum(len(rule.get(f) or '') for rule in sampled for f in HEAVY_RULE_FIELDS)
+            avg_text_bytes = text_bytes / len(sampled) if sampled else 0
+        except Exception as e:
+            logging.warning("No se pudo muestrear el tamaño de las reglas: %s", e)
+
+    rules = counts['hr.salary.rule']
+    values = counts['hr.rule.parameter.value']
+    rule_bytes = EST_RULE_BYTES if avg_text_bytes is None else EST_RULE_BYTES / 2 + avg_text_bytes
+    estimated_size = (
+        EST_HEADER_BYTES
+        + rules * rule_bytes
+        + counts['hr.rule.parameter'] * EST_PARAMETER_BYTES
+        + values * EST_PARAMETER_VALUE_BYTES
+        + counts['hr.payslip.input.type'] * EST_INPUT_BYTES
+    )
+
+    if values >= PARALLEL_VALUES_THRESHOLD:
+        workers = min(MAX_PLAN_WORKERS, max(2, values // VALUES_PER_WORKER))
+        # Al menos cuatro particiones por worker para repartir la carga
+        partition_size = max(500, min(5000, values // (workers * 4)))
+    else:
+        workers = 1
+        partition_size = DEFAULT_PARTITION_SIZE
+
+    return {
+        'counts': counts,
+        'avg_text_bytes': avg_text_bytes,
+        'estimated_size': estimated_size,
+        'workers': workers,
+        'partition_size': partition_size,
+        'split_heavy_fields': rules * (avg_text_bytes or 0) > HEAVY_FIELDS_THRESHOLD,
+        'stream_output': estimated_size > STREAM_OUTPUT_THRESHOLD,
+    }
+
+
+def print_plan(plan):
+    """Print an extraction plan returned by plan_extraction."""
+    print(f"\n{'='*70}")
+    print("PLAN DE EXTRACCION")
+    print(f"{'='*70}")
+    for model, count in plan['counts'].items():
+        print(f"{model:<35} {count:>10} registros")
+    print(f"{'-'*70}")
+    if plan['avg_text_bytes'] is not None:
+        print(f"Tamano promedio del codigo por regla: {format_size(plan['avg_text_bytes'])}")
+    print(f"Tamano estimado del XML: {format_size(plan['estimated_size'])}")
+    print(f"Workers para valores de parametros: {plan['workers']}")
+    print(f"Tamano de particion: {plan['partition_size']}")
+    print(f"Separar campos de texto en segunda lectura: {'si' if plan['split_heavy_fields'] else 'no'}")
+    print(f"Escritura del XML por registros (streaming): {'si' if plan['stream_output'] else 'no'}")
+    print(f"{'='*70}\n")
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread."""
+
+    def prepare(self, record):
+        # Los registros no salen del proceso: el formateo (y el JSON de los
+        # eventos) se hace en el hilo del QueueListener, fuera del hilo caller
+        return record
+
+
+class FlushableQueueListener(QueueListener):
+    """QueueListener that can wait until the queued records are written."""
+
+    def handle(self, record):
+        if isinstance(record, threading.Event):
+            record.set()
+        else:
+            super().handle(record)
+
+    def flush(self, timeout=5):
+        done = threading.Event()
+        self.queue.put_nowait(done)
+        done.wait(timeout)
+
+
+def flush_logging():
+    """Write the pending log records before printing a report to stdout."""
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.flush()
+
+
+class EventPayload:
+    """Event data serialized to a JSON line only when it is written."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False, default=str)
+
+
+def is_event_record(record):
+    """Return True for records sent through EVENT_LOGGER."""
+    return record.name == EVENT_LOGGER.name
+
+
+def emit_event(event, **data):
+    """Write an event to the JSON-lines stream (no-op without --events-file)."""
+    if not _EVENTS_ENABLED:
+        return
+    payload = {'event': event, 'ts': datetime.now().isoformat(timespec='milliseconds')}
+    payload.update(data)
+    EVENT_LOGGER.info('%s', EventPayload(payload))
+
+
+@contextmanager
+def log_phase(phase, **data):
+    """Emit phase_start/phase_end events around a block of work.
+
+    The yielded dict is merged into the phase_end event, so the block can
+    report its counts.
+    """
+    start = time.perf_counter()
+    emit_event('phase_start', phase=phase, **data)
+    result = {}
+    try:
+        yield result
+    finally:
+        emit_event('phase_end', phase=phase,
+                   elapsed=round(time.perf_counter() - start, 3), **result)
+
+
+def setup_logging(log_file=None, events_file=None):
+    """Configure logging to file and console through a background queue.
+
+    With events_file the records of EVENT_LOGGER are written there as JSON
+    lines and kept out of the log file and the console.
+    """
+    global _LOG_LISTENER, _EVENTS_ENABLED
+    log_filename = log_file or f"payroll_extractor_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    if _LOG_LISTENER is not None:
+        return log_filename
+
+    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+    handlers = [file_handler, console_handler]
+    for handler in handlers:
+        handler.addFilter(lambda record: not is_event_record(record))
+
+    if events_file:
+        events_handler = logging.FileHandler(events_file, encoding='utf-8')
+        events_handler.setFormatter(logging.Formatter('%(message)s'))
+        events_handler.addFilter(is_event_record)
+        handlers.append(events_handler)
+        _EVENTS_ENABLED = True
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    EVENT_LOGGER.setLevel(logging.INFO)
+
+    _LOG_LISTENER = FlushableQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _LOG_LISTENER.start()
+    # Vaciar la cola antes de salir (también en sys.exit y Ctrl+C)
+    atexit.register(_LOG_LISTENER.stop)
     return log_filename
 
 
+def fetch_shared_data(models, db, uid, password, url=None, workers=1,
+                      partition_size=DEFAULT_PARTITION_SIZE, schema=None, as_of=None):
+    """Fetch the records shared by every exported file (categories, structures,
+    rule parameters with their values and input types).
+
+    url, workers and partition_size enable the parallel partitioned fetch of
+    the parameter values; schema (see load_schema) limits the requested fields
+    to the ones available on the server. With as_of only the parameter value
+    in effect on that date and the later ones are exported.
+    """
+    logging.info("Fetching salary rule categories...")
+    with log_phase('categories') as phase:
+        categories = get_salary_rule_categories(models, db, uid, password, schema=schema)
+        phase['count'] = len(categories)
+    logging.info("Found %d categories", len(categories))
+
+    logging.info("Fetching payroll structures...")
+    with log_phase('structures') as phase:
+        structures = get_payroll_structures(models, db, uid, password, schema=schema)
+        phase['count'] = len(structures)
+    logging.info("Found %d structures", len(structures))
+
+    # Obtener parámetros de reglas
+    logging.info("Fetching rule parameters...")
+    with log_phase('rule_parameters') as phase:
+        rule_parameters = get_rule_parameters(models, db, uid, password, schema=schema)
+        phase['count'] = len(rule_parameters)
+    logging.info("Found %d rule parameters", len(rule_parameters))
+
+    # Obtener valores de parámetros
+    logging.info("Fetching parameter values...")
+    parameter_ids = [p['id'] for p in rule_parameters] if rule_parameters else None
+    history = None
+    date_from_min = None
+    with log_phase('parameter_values', workers=workers) as phase:
+        if as_of:
+            history = get_parameter_value_history(models, db, uid, password, as_of, parameter_ids)
+            if history is not None:
+                # El valor vigente más antiguo acota la ventana en el servidor
+                date_from_min = min((eff for eff, _count in history.values()), default=as_of)
+        parameter_values = get_rule_parameter_values(models, db, uid, password, parameter_ids,
+                                                     url=url, workers=workers,
+                                                     partition_size=partition_size,
+                                                     schema=schema, date_from_min=date_from_min)
+        parameter_value_counts = None
+        fetched = len(parameter_values)
+        if as_of:
+            parameter_values, parameter_value_counts = select_effective_values(
+                parameter_values, as_of, history)
+            phase['fetched'] = fetched
+        phase['count'] = len(parameter_values)
+    if as_of:
+        logging.info("Found %d parameter values, %d in effect since %s",
+                     fetched, len(parameter_values), as_of)
+    else:
+        logging.info("Found %d parameter values", len(parameter_values))
+
+    # Obtener inputs
+    logging.info("Fetching salary rule inputs...")
+    with log_phase('inputs') as phase:
+        inputs = get_salary_rule_inputs(models, db, uid, password, schema=schema)
+        phase['count'] = len(inputs)
+    logging.info("Found %d inputs", len(inputs))
+
+    return {
+        'categories': categories,
+        'structures': structures,
+        'rule_parameters': rule_parameters,
+        'parameter_values': parameter_values,
+        'parameter_value_counts': parameter_value_counts,
+        'inputs': inputs,
+        'schema': schema,
+    }
+
+
+def get_output_filename(structure=None, output=None):
+    """Return the XML file name for a structure (or for the complete export)."""
+    if output:
+        return output
+    if structure:
+        return f"payroll_rules_{sanitize_filename(structure['name'])}.xml"
+    return 'payroll_rules_complete.xml'
+
+
+def xml_to_string(xml_root):
+    """Pretty-print an XML tree as a complete XML document."""
+    xml_string = prettify_xml(xml_root)
+
+    # Asegurar declaracion XML correcta
+    if not xml_string.startswith('<?xml'):
+        xml_string = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_string
+    return xml_string
+
+
+def write_xml_file(xml_root, output_file):
+    """Pretty-print an XML tree and write it to output_file."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(xml_to_string(xml_root))
+
+
+def split_module_shards(xml_root, shard_size=DEFAULT_SHARD_SIZE):
+    """Split the generated XML into data files by model and by structure.
+
+    Comments stay with the record that follows them and every rule parameter
+    stays in the same file as its values. Rules are grouped by their
+    struct_id ref. The result follows MODULE_LOAD_ORDER.
+
+    Returns:
+        list: (relative file path, list of elements) in load order.
+    """
+    prefixes = dict(MODULE_LOAD_ORDER)
+    groups = {}
+    pending = []
+    current_block = None
+
+    for child in xml_root:
+        if child.tag is ET.Comment:
+            pending.append(child)
+            continue
+
+        model = child.get('model')
+        if model == 'hr.rule.parameter.value' and current_block is not None:
+            # Los valores van en el mismo bloque que su parámetro
+            current_block[0] += 1
+            current_block[1].extend(pending + [child])
+            pending = []
+            continue
+
+        prefix = prefixes.get(model, 'other')
+        if model == 'hr.salary.rule':
+            struct_ref = child.find("field[@name='struct_id']")
+            struct_name = struct_ref.get('ref').split('.')[-1] if struct_ref is not None else 'no_structure'
+            if struct_name.startswith('aginc_structure_'):
+                struct_name = struct_name[len('aginc_structure_'):]
+            prefix = f"{prefix}_{sanitize_filename(struct_name)}"
+
+        current_block = [1, pending + [child]]
+        pending = []
+        groups.setdefault((model, prefix), []).append(current_block)
+        if model != 'hr.rule.parameter':
+            current_block = None
+
+    load_rank = {model: rank for rank, (model, _prefix) in enumerate(MODULE_LOAD_ORDER)}
+    ordered_groups = sorted(groups.items(), key=lambda item: load_rank.get(item[0][0], len(load_rank)))
+
+    shards = []
+    for (_model, prefix), blocks in ordered_groups:
+        shard_elements = []
+        shard_records = 0
+        number = 1
+        for records, elements in blocks:
+            if shard_records and shard_records + records > shard_size:
+                shards.append((f"data/{prefix}_{number:03d}.xml", shard_elements))
+                shard_elements, shard_records, number = [], 0, number + 1
+            shard_elements.extend(elements)
+            shard_records += records
+        if shard_elements:
+            shards.append((f"data/{prefix}_{number:03d}.xml", shard_elements))
+    return shards
+
+
+def format_manifest(manifest):
+    """Format a manifest dict the way Odoo manifests are usually written."""
+    lines = ['{']
+    for key, value in manifest.items():
+        if isinstance(value, list):
+            lines.append(f"    {key!r}: [")
+            lines.extend(f"        {item!r}," for item in value)
+            lines.append("    ],")
+        else:
+            lines.append(f"    {key!r}: {value!r},")
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_module(xml_root, module_dir, module_name, shard_size=DEFAULT_SHARD_SIZE,
+                 workers=DEFAULT_WRITE_WORKERS):
+    """Write the generated XML as an installable Odoo module skeleton.
+
+    The data files are written concurrently and only when their content
+    changed. The manifest keeps any key edited by hand and is rewritten only
+    when its data list changes. Data files that are no longer produced are
+    removed.
+
+    Returns:
+        tuple: (list of shard paths, list of shard paths written)
+    """
+    shards = split_module_shards(xml_root, shard_size)
+    os.makedirs(os.path.join(module_dir, 'data'), exist_ok=True)
+
+    def write_shard(shard):
+        path, elements = shard
+        shard_root = ET.Element('odoo')
+        shard_root.extend(elements)
+        content = xml_to_string(shard_root)
+        full_path = os.path.join(module_dir, path)
+        try:
+            with open(full_path, encoding='utf-8') as f:
+                if f.read() == content:
+                    return None
+        except FileNotFoundError:
+            pass
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        changed = [path for path in executor.map(write_shard, shards) if path]
+
+    data_files = [path for path, _elements in shards]
+    manifest_path = os.path.join(module_dir, '__manifest__.py')
+    manifest = {
+        'name': f"{module_name} - Payroll Rules",
+        'version': '18.0.1.0.0',
+        'category': 'Human Resources/Payroll',
+        'depends': ['hr_payroll'],
+        'data': [],
+        'license': 'LGPL-3',
+        'installable': True,
+    }
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = ast.literal_eval(f.read())
+
+    old_files = manifest.get('data', [])
+    if old_files != data_files:
+        for path in old_files:
+            if path not in data_files and path.startswith('data/'):
+                stale = os.path.join(module_dir, path)
+                if os.path.exists(stale):
+                    os.remove(stale)
+        manifest['data'] = data_files
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            f.write(format_manifest(manifest))
+
+    init_path = os.path.join(module_dir, '__init__.py')
+    if not os.path.exists(init_path):
+        open(init_path, 'w').close()
+
+    return data_files, changed
+
+
+def export_rules(models, db, uid, password, args, data, structure_id=None, output_file=None):
+    """Fetch the rules of a structure (or all rules) and write them, together
+    with the shared data, to output_file.
+
+    Returns:
+        dict: output_file, rules and skipped_rules of the export, or None if
+              no rules were found.
+    """
+    logging.info("Fetching salary rules...")
+    with log_phase('rules', structure_id=structure_id) as phase:
+        rules = get_salary_rules(models, db, uid, password, structure_id=structure_id,
+                                 schema=data.get('schema'),
+                                 split_heavy_fields=getattr(args, 'split_heavy_fields', False),
+                                 partition_size=args.partition_size or DEFAULT_PARTITION_SIZE)
+        phase['count'] = len(rules)
+    logging.info("Found %d rules", len(rules))
+
+    if not rules:
+        return None
+
+    logging.info("Generating XML with complete fields and proper references...")
+    with log_phase('xml_generation') as phase:
+        xml_root, skipped_rules = create_xml_output(
+            rules, data['categories'], data['structures'], models, db, uid, password,
+            generate_xmlids=not args.no_xmlid_lookup,
+            module_prefix=args.module_prefix,
+            rule_parameters=data['rule_parameters'],
+            parameter_values=data['parameter_values'],
+            inputs=data['inputs'],
+            include_without_xmlid=args.include_without_xmlid,
+            parameter_value_counts=data.get('parameter_value_counts'),
+            include_dependencies=args.include_dependencies
+        )
+        phase['records'] = len(xml_root.findall('.//record'))
+        phase['skipped_rules'] = len(skipped_rules)
+
+    with log_phase('write') as phase:
+        if getattr(args, 'module_dir', None):
+            shard_files, changed = write_module(
+                xml_root, args.module_dir, args.module_prefix,
+                shard_size=args.shard_size, workers=args.write_workers
+            )
+            output_file = args.module_dir
+            logging.info("Module data files: %d (%d changed)", len(shard_files), len(changed))
+            for path in changed:
+                logging.info("Archivo de datos actualizado: %s", path)
+            phase['files'] = len(shard_files)
+            phase['changed'] = len(changed)
+        elif getattr(args, 'stream_output', False):
+            write_xml_stream(xml_root, output_file)
+        else:
+            write_xml_file(xml_root, output_file)
+        phase['output'] = output_file
+
+    return {
+        'output_file': output_file,
+        'rules': rules,
+        'skipped_rules': skipped_rules,
+    }
+
+
+def get_model_fingerprint(models, db, uid, password, model):
+    """Return a cheap (record count, max write_date) fingerprint of a model.
+
+    Any create, write, archive or unlink changes at least one of both values,
+    so comparing fingerprints detects changes without reading the records.
+    """
+    try:
+        count = models.execute_kw(
+            db, uid, password,
+            model, 'search_count',
+            [[]]
+        )
+        latest = models.execute_kw(
+            db, uid, password,
+            model, 'search_read',
+            [[]],
+            {'fields': ['write_date'], 'order': 'write_date desc', 'limit': 1}
+        )
+        return count, latest[0]['write_date'] if latest else None
+    except Exception as e:
+        logging.warning("No se pudo consultar %s: %s", model, e)
+        return None
+
+
+def get_rule_write_dates(models, db, uid, password, structure_id=None):
+    """Fetch (write_date, struct_id) of every salary rule, keyed by rule id."""
+    domain = []
+    if structure_id:
+        domain = [('struct_id', '=', structure_id)]
+
+    rules = models.execute_kw(
+        db, uid, password,
+        'hr.salary.rule', 'search_read',
+        [domain],
+        {'fields': ['id', 'write_date', 'struct_id']}
+    )
+    return {
+        rule['id']: (rule['write_date'], rule['struct_id'][0] if rule.get('struct_id') else None)
+        for rule in rules
+    }
+
+
+def diff_rule_structures(old_rules, new_rules):
+    """Return the structure ids touched by rules created, modified or removed
+    between two get_rule_write_dates() snapshots."""
+    affected = set()
+    for rule_id in set(old_rules) | set(new_rules):
+        old = old_rules.get(rule_id)
+        new = new_rules.get(rule_id)
+        if old == new:
+            continue
+        # Una regla movida de estructura afecta a la anterior y a la nueva
+        for snapshot in (old, new):
+            if snapshot and snapshot[1]:
+                affected.add(snapshot[1])
+    return affected
+
+
+def watch_changes(models, db, uid, password, args, schema=None):
+    """Poll the payroll models and regenerate the affected structure files.
+
+    Every cycle only reads the cheap fingerprint of WATCHED_MODELS. Changes in
+    hr.salary.rule regenerate the structures of the changed rules; changes in
+    parameters, their values or input types regenerate every watched structure
+    because those records are written to all files. Bursts of edits are
+    debounced: files are regenerated once the models stay quiet for
+    --watch-debounce seconds.
+    """
+    def fingerprints():
+        return {model: get_model_fingerprint(models, db, uid, password, model)
+                for model in WATCHED_MODELS}
+
+    def regenerate(structure_ids):
+        data = fetch_shared_data(models, db, uid, password, url=args.url,
+                                 workers=args.workers, partition_size=args.partition_size,
+                                 schema=schema, as_of=args.as_of)
+        for struct_id in sorted(structure_ids):
+            structure = data['structures'].get(struct_id)
+            if not structure:
+                logging.warning("Estructura %s ya no existe, se omite", struct_id)
+                continue
+            output = args.output if args.structure_id else None
+            output_file = get_output_filename(structure, output)
+            try:
+                result = export_rules(models, db, uid, password, args, data,
+                                      structure_id=struct_id, output_file=output_file)
+            except DependencyError as e:
+                logging.error("Estructura %s no regenerada: %s", structure['name'], e)
+                continue
+            if result:
+                logging.info("Estructura %s regenerada en %s", structure['name'], output_file)
+                emit_event('structure_exported', structure_id=struct_id,
+                           output=result['output_file'], rules=len(result['rules']),
+                           skipped_rules=len(result['skipped_rules']))
+            else:
+                logging.info("Estructura %s sin reglas, archivo no generado", structure['name'])
+        return data
+
+    data = regenerate(
+        [args.structure_id] if args.structure_id
+        else get_payroll_structures(models, db, uid, password).keys()
+    )
+    last_prints = fingerprints()
+    last_rules = get_rule_write_dates(models, db, uid, password, args.structure_id)
+
+    logging.info("Watching for changes every %ss (Ctrl+C to stop)...", args.watch_interval)
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            current = fingerprints()
+            if current == last_prints:
+                continue
+
+            # Esperar a que terminen las ediciones en ráfaga
+            while True:
+                time.sleep(args.watch_debounce)
+                settled = fingerprints()
+                if settled == current:
+                    break
+                current = settled
+
+            changed_models = [m for m in WATCHED_MODELS if current[m] != last_prints[m]]
+            logging.info("Cambios detectados en: %s", ', '.join(changed_models))
+            emit_event('changes_detected', models=changed_models)
+
+            current_rules = get_rule_write_dates(models, db, uid, password, args.structure_id)
+            if any(m != 'hr.salary.rule' for m in changed_models):
+                if args.structure_id:
+                    affected = {args.structure_id}
+                else:
+                    affected = set(data['structures']) | diff_rule_structures(last_rules, current_rules)
+            else:
+                affected = diff_rule_structures(last_rules, current_rules)
+
+            if affected:
+                data = regenerate(affected)
+            last_prints = current
+            last_rules = current_rules
+    except KeyboardInterrupt:
+        logging.info("Watch mode stopped.")
+
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date (expected YYYY-MM-DD): {value}")
+
+
+def positive_int(value):
+    """argparse type for integers greater than zero."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid value (expected a positive integer): {value}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Extract payroll rules from Odoo 18 to XML with complete fields and proper references'
@@ -659,8 +1976,16 @@ def main():
     parser.add_argument('--password', required=True, help='Password or API key')
     parser.add_argument('--output', default=None,
                        help='Output XML file (auto-generated from structure name if not specified)')
+    parser.add_argument('--module-dir', default=None,
+                       help='Write an installable module (manifest + data files split by model and structure) to this directory')
+    parser.add_argument('--shard-size', type=positive_int, default=DEFAULT_SHARD_SIZE,
+                       help=f'Maximum records per module data file (default: {DEFAULT_SHARD_SIZE})')
+    parser.add_argument('--write-workers', type=positive_int, default=DEFAULT_WRITE_WORKERS,
+                       help=f'Threads writing the module data files (default: {DEFAULT_WRITE_WORKERS})')
     parser.add_argument('--list-structures', action='store_true',
                        help='List all available payroll structures and exit')
+    parser.add_argument('--catalogue', action='store_true',
+                       help='List structures with rule counts and estimated export size, and exit')
     parser.add_argument('--structure-id', type=int,
                        help='Extract rules only for the specified structure ID')
     parser.add_argument('--module-prefix', default='l10n_do_hr_payroll',
@@ -669,112 +1994,165 @@ def main():
                        help='Skip looking up existing XML IDs (faster but may generate inconsistent IDs)')
     parser.add_argument('--include-without-xmlid', action='store_true',
                        help='Include rules without xmlid (generates automatic xmlid). Default: skip rules without xmlid')
+    parser.add_argument('--include-dependencies', action='store_true',
+                       help='Also export the categories (with ancestors), structures and structure types referenced by the rules')
     parser.add_argument('--log-file', default=None,
                        help='Log file path (auto-generated if not specified)')
+    parser.add_argument('--events-file', default=None,
+                       help='Write a JSON-lines event stream (phases, counts, skipped rules) to this file')
+    parser.add_argument('--watch', action='store_true',
+                       help='Keep running and regenerate the structure files when payroll rules change')
+    parser.add_argument('--watch-interval', type=float, default=30.0,
+                       help='Seconds between change checks in watch mode (default: 30)')
+    parser.add_argument('--watch-debounce', type=float, default=5.0,
+                       help='Seconds without new changes before regenerating in watch mode (default: 5)')
+    parser.add_argument('--workers', type=positive_int, default=None,
+                       help='Parallel connections used to fetch parameter values (default: chosen by the plan)')
+    parser.add_argument('--partition-size', type=positive_int, default=None,
+                       help='Records per partition in parallel fetches (default: chosen by the plan)')
+    parser.add_argument('--as-of', '--since', dest='as_of', type=parse_date, default=None,
+                       help='Export only the parameter values in effect on DATE (YYYY-MM-DD) and later ones')
+    parser.add_argument('--plan-only', action='store_true',
+                       help='Print the extraction plan and its estimates, and exit without extracting')
+    parser.add_argument('--no-plan-sample', action='store_true',
+                       help='Do not sample rule text sizes while planning')
+    parser.add_argument('--async-client', action='store_true',
+                       help='Use the asyncio client (keep-alive connection pool) for the Odoo requests')
+    parser.add_argument('--max-connections', type=positive_int, default=None,
+                       help='Maximum concurrent connections of the async client (default: 4)')
+    parser.add_argument('--schema-file', default=None,
+                       help='Schema file written by inspect_odoo_fields.py --schema-out (requests only available fields)')
 
     args = parser.parse_args()
 
+    if args.module_dir and args.watch:
+        parser.error("--module-dir cannot be combined with --watch")
+    if args.module_dir and args.structure_id:
+        # El módulo se regenera completo: un export filtrado borraría los
+        # archivos de las demás estructuras
+        parser.error("--module-dir cannot be combined with --structure-id")
+
     # Configure logging
-    log_filename = setup_logging(args.log_file)
+    log_filename = setup_logging(args.log_file, events_file=args.events_file)
+    emit_event('run_start', url=args.url, db=args.db, structure_id=args.structure_id,
+               mode='watch' if args.watch else 'export')
+
+    schema = None
+    if args.schema_file:
+        try:
+            schema = load_schema(args.schema_file)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not load schema file {args.schema_file}: {e}", file=sys.stderr)
+            sys.exit(1)
 
-    print(f"Connecting to Odoo at {args.url}...")
+    logging.info("Connecting to Odoo at %s...", args.url)
     try:
-        uid, models = connect_odoo(args.url, args.db, args.user, args.password)
-        print(f"Connected successfully (uid: {uid})")
+        with log_phase('connect'):
+            uid, models = connect_odoo(args.url, args.db, args.user, args.password,
+                                       async_client=args.async_client,
+                                       max_connections=args.max_connections)
+        logging.info("Connected successfully (uid: %s)", uid)
     except Exception as e:
+        flush_logging()
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+    # Los informes se imprimen directamente: vaciar antes la cola de logging
+    flush_logging()
+
     # List structures mode
     if args.list_structures:
         list_structures(models, args.db, uid, args.password)
         sys.exit(0)
 
-    print("Fetching salary rule categories...")
-    categories = get_salary_rule_categories(models, args.db, uid, args.password)
-    print(f"Found {len(categories)} categories")
-
-    print("Fetching payroll structures...")
-    structures = get_payroll_structures(models, args.db, uid, args.password)
-    print(f"Found {len(structures)} structures")
+    # Catalogue mode
+    if args.catalogue:
+        list_structure_catalogue(models, args.db, uid, args.password)
+        sys.exit(0)
 
-    # Validate structure_id if provided
+    # Validar structure_id con una consulta ligera, antes de la descarga
+    # de parámetros y valores (también en modo watch)
     selected_structure = None
     if args.structure_id:
+        structures = get_payroll_structures(models, args.db, uid, args.password, schema=schema)
         if args.structure_id not in structures:
+            flush_logging()
             print(f"Error: Structure ID {args.structure_id} not found.", file=sys.stderr)
             print("Use --list-structures to see available structures.", file=sys.stderr)
             sys.exit(1)
         selected_structure = structures[args.structure_id]
-        print(f"Filtering by structure: {selected_structure['name']} (ID: {args.structure_id})")
-
-    print("Fetching salary rules...")
-    rules = get_salary_rules(models, args.db, uid, args.password,
-                            structure_id=args.structure_id)
-    print(f"Found {len(rules)} rules")
+        logging.info("Filtering by structure: %s (ID: %s)",
+                     selected_structure['name'], args.structure_id)
+
+    # Plan de extracción: los valores explícitos en la línea de comandos tienen prioridad
+    with log_phase('plan') as phase:
+        plan = plan_extraction(models, args.db, uid, args.password,
+                               structure_id=args.structure_id, sample=not args.no_plan_sample)
+        phase['estimated_size'] = int(plan['estimated_size'])
+    if args.workers is None:
+        args.workers = plan['workers']
+    else:
+        plan['workers'] = args.workers
+    if args.partition_size is None:
+        args.partition_size = plan['partition_size']
+    else:
+        plan['partition_size'] = args.partition_size
+    args.split_heavy_fields = plan['split_heavy_fields']
+    args.stream_output = plan['stream_output']
+    flush_logging()
+    print_plan(plan)
 
-    if not rules:
-        print("No rules found for the specified criteria.")
+    if args.plan_only:
         sys.exit(0)
 
-    # Obtener parámetros de reglas
-    print("Fetching rule parameters...")
-    rule_parameters = get_rule_parameters(models, args.db, uid, args.password)
-    print(f"Found {len(rule_parameters)} rule parameters")
-
-    # Obtener valores de parámetros
-    print("Fetching parameter values...")
-    parameter_ids = [p['id'] for p in rule_parameters] if rule_parameters else None
-    parameter_values = get_rule_parameter_values(models, args.db, uid, args.password, parameter_ids)
-    print(f"Found {len(parameter_values)} parameter values")
+    # Watch mode
+    if args.watch:
+        watch_changes(models, args.db, uid, args.password, args, schema=schema)
+        sys.exit(0)
 
-    # Obtener inputs
-    print("Fetching salary rule inputs...")
-    inputs = get_salary_rule_inputs(models, args.db, uid, args.password)
-    print(f"Found {len(inputs)} inputs")
-
-    print("Generating XML with complete fields and proper references...")
-    xml_root, skipped_rules = create_xml_output(
-        rules, categories, structures, models, args.db, uid, args.password,
-        generate_xmlids=not args.no_xmlid_lookup,
-        module_prefix=args.module_prefix,
-        rule_parameters=rule_parameters,
-        parameter_values=parameter_values,
-        inputs=inputs,
-        include_without_xmlid=args.include_without_xmlid
-    )
+    data = fetch_shared_data(models, args.db, uid, args.password, url=args.url,
+                             workers=args.workers, partition_size=args.partition_size,
+                             schema=schema, as_of=args.as_of)
 
-    xml_string = prettify_xml(xml_root)
+    # Determine output filename
+    output_file = get_output_filename(selected_structure, args.output)
 
-    # Asegurar declaracion XML correcta
-    if not xml_string.startswith('<?xml'):
-        xml_string = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_string
+    try:
+        result = export_rules(models, args.db, uid, args.password, args, data,
+                              structure_id=args.structure_id, output_file=output_file)
+    except DependencyError as e:
+        flush_logging()
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    # Determine output filename
-    if args.output:
-        output_file = args.output
-    elif selected_structure:
-        structure_name = sanitize_filename(selected_structure['name'])
-        output_file = f"payroll_rules_{structure_name}.xml"
-    else:
-        output_file = 'payroll_rules_complete.xml'
+    if not result:
+        logging.info("No rules found for the specified criteria.")
+        emit_event('run_end', rules=0)
+        sys.exit(0)
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(xml_string)
+    rules = result['rules']
+    skipped_rules = result['skipped_rules']
 
     # Calcular reglas exportadas (total - omitidas)
     exported_rules_count = len(rules) - len(skipped_rules)
+    emit_event('run_end', output=result['output_file'], rules=len(rules),
+               exported_rules=exported_rules_count, skipped_rules=len(skipped_rules),
+               rule_parameters=len(data['rule_parameters']),
+               parameter_values=len(data['parameter_values']), inputs=len(data['inputs']))
+    if skipped_rules:
+        logging.info("Total reglas omitidas: %d", len(skipped_rules))
 
+    flush_logging()
     print(f"\n{'='*70}")
     print("RESULTADO DE LA EXTRACCION")
     print(f"{'='*70}")
-    print(f"XML exportado a: {output_file}")
+    print(f"XML exportado a: {result['output_file']}")
     print(f"Total reglas encontradas: {len(rules)}")
     print(f"Reglas exportadas: {exported_rules_count}")
     print(f"Reglas omitidas (sin xmlid): {len(skipped_rules)}")
-    print(f"Parametros de reglas exportados: {len(rule_parameters)}")
-    print(f"Valores de parametros exportados: {len(parameter_values)}")
-    print(f"Inputs exportados: {len(inputs)}")
+    print(f"Parametros de reglas exportados: {len(data['rule_parameters'])}")
+    print(f"Valores de parametros exportados: {len(data['parameter_values'])}")
+    print(f"Inputs exportados: {len(data['inputs'])}")
 
     # Mostrar detalle de reglas omitidas
     if skipped_rules:
@@ -788,7 +2166,6 @@ def main():
         print(f"{'-'*70}")
         print(f"ADVERTENCIA: {len(skipped_rules)} regla(s) fueron omitidas por no tener xmlid.")
         print(f"Estas reglas no fueron incluidas en el XML para evitar duplicados.")
-        logging.info(f"Total reglas omitidas: {len(skipped_rules)}")
 
     print(f"\nLog guardado en: {log_filename}")
     print(f"{'='*70}")
@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+"""
+Odoo Payroll Rules Simulator
+Evalua offline las reglas salariales exportadas a XML para un lote de empleados,
+sin calcular nominas reales en Odoo.
+"""
+
+import xml.etree.ElementTree as ET
+import argparse
+import ast
+import bisect
+import csv
+import random
+import sys
+import time
+from datetime import date
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Builtins disponibles en el codigo de las reglas (similar a safe_eval)
+SAFE_BUILTINS = {
+    'abs': abs, 'all': all, 'any': any, 'bool': bool, 'dict': dict,
+    'divmod': divmod, 'enumerate': enumerate, 'float': float, 'int': int,
+    'isinstance': isinstance, 'len': len, 'list': list, 'max': max,
+    'min': min, 'pow': pow, 'range': range, 'round': round, 'set': set,
+    'sorted': sorted, 'str': str, 'sum': sum, 'tuple': tuple, 'zip': zip,
+    'True': True, 'False': False, 'None': None,
+}
+
+# Cache de objetos de codigo: {(fuente, modo): code object}
+_CODE_CACHE = {}
+
+
+def compile_rule_code(source, mode, label):
+    """Compile rule code once and return the cached code object."""
+    key = (source, mode)
+    code = _CODE_CACHE.get(key)
+    if code is None:
+        code = compile(source, f'<rule {label}>', mode)
+        _CODE_CACHE[key] = code
+    return code
+
+
+class AttrDict(dict):
+    """Dict that also allows attribute access (categories.BASIC, inputs.HE.amount)."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Totals(AttrDict):
+    """Accumulated totals by code; missing codes count as 0."""
+
+    def __missing__(self, key):
+        return 0.0
+
+
+class RuleTotals(AttrDict):
+    """Results of the computed rules by code; missing rules count as zero."""
+
+    def __missing__(self, key):
+        return AttrDict(total=0.0, amount=0.0, quantity=0.0, rate=0.0)
+
+
+class Payslip:
+    """Minimal payslip exposing the dates and the rule parameter lookup."""
+
+    def __init__(self, date_from, date_to, parameters):
+        self.date_from = date_from
+        self.date_to = date_to
+        self._parameters = parameters
+
+    def rule_parameter(self, code):
+        return self._parameters.get_value(code, self.date_to)
+
+    _rule_parameter = rule_parameter
+
+
+class ParameterIndex:
+    """Rule parameter values indexed by code and sorted by date_from."""
+
+    def __init__(self):
+        self._dates = {}
+        self._values = {}
+
+    def add(self, code, date_from, raw_value):
+        dates = self._dates.setdefault(code, [])
+        values = self._values.setdefault(code, [])
+        pos = bisect.bisect_right(dates, date_from)
+        dates.insert(pos, date_from)
+        values.insert(pos, raw_value)
+
+    def get_value(self, code, on_date):
+        """Return the value in effect on on_date (like Odoo's _rule_parameter)."""
+        dates = self._dates.get(code)
+        if not dates:
+            raise KeyError(f"Parametro de regla no encontrado: {code}")
+        pos = bisect.bisect_right(dates, str(on_date)) - 1
+        if pos < 0:
+            raise KeyError(f"Parametro {code} sin valor vigente al {on_date}")
+        value = self._values[code][pos]
+        if isinstance(value, str):
+            # Odoo evalua parameter_value con ast.literal_eval; se evalua una sola vez
+            value = ast.literal_eval(value)
+            self._values[code][pos] = value
+        return value
+
+    def __len__(self):
+        return len(self._dates)
+
+
+def _field_text(record, name):
+    field = record.find(f"field[@name='{name}']")
+    if field is None:
+        return None
+    return field.text if field.text is not None else ''
+
+
+def _field_ref(record, name):
+    field = record.find(f"field[@name='{name}']")
+    return field.get('ref') if field is not None else None
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _category_code_from_ref(ref):
+    """Guess a category code from its xmlid (hr_payroll.BASIC, aginc_BASIC)."""
+    name = ref.split('.')[-1]
+    if name.startswith('aginc_'):
+        name = name[len('aginc_'):]
+    return name
+
+
+def load_exported_xml(path):
+    """Load rules, categories, parameters and input types from an exported XML file.
+
+    Returns:
+        dict: rules (list of dicts), categories ({ref: (code, parent_ref)}),
+              parameters (ParameterIndex) and input_codes (list).
+    """
+    root = ET.parse(path).getroot()
+
+    rules = []
+    categories = {}
+    parameter_codes = {}
+    pending_values = []
+    input_codes = []
+
+    for record in root.iter('record'):
+        model = record.get('model')
+        xmlid = record.get('id')
+
+        if model == 'hr.salary.rule':
+            if _field_text(record, 'active') == 'False':
+                continue
+            rules.append({
+                'xmlid': xmlid,
+                'name': _field_text(record, 'name'),
+                'code': _field_text(record, 'code') or xmlid,
+                'sequence': int(_to_float(_field_text(record, 'sequence'))),
+                'category_ref': _field_ref(record, 'category_id'),
+                'struct_ref': _field_ref(record, 'struct_id'),
+                'condition_select': _field_text(record, 'condition_select') or 'none',
+                'condition_python': _field_text(record, 'condition_python'),
+                'condition_range': _field_text(record, 'condition_range') or 'contract.wage',
+                'condition_range_min': _to_float(_field_text(record, 'condition_range_min')),
+                'condition_range_max': _to_float(_field_text(record, 'condition_range_max')),
+                'amount_select': _field_text(record, 'amount_select') or 'fix',
+                'amount_fix': _to_float(_field_text(record, 'amount_fix')),
+                'amount_percentage': _to_float(_field_text(record, 'amount_percentage')),
+                'amount_percentage_base': _field_text(record, 'amount_percentage_base'),
+                'amount_python_compute': _field_text(record, 'amount_python_compute'),
+                'quantity': _field_text(record, 'quantity') or '1.0',
+            })
+        elif model == 'hr.salary.rule.category':
+            categories[xmlid] = (_field_text(record, 'code'), _field_ref(record, 'parent_id'))
+        elif model == 'hr.rule.parameter':
+            parameter_codes[xmlid] = _field_text(record, 'code')
+        elif model == 'hr.rule.parameter.value':
+            pending_values.append((
+                _field_ref(record, 'rule_parameter_id'),
+                _field_text(record, 'date_from') or '',
+                _field_text(record, 'parameter_value'),
+            ))
+        elif model == 'hr.payslip.input.type':
+            input_codes.append(_field_text(record, 'code'))
+
+    parameters = ParameterIndex()
+    for param_ref, date_from, raw_value in pending_values:
+        code = parameter_codes.get(param_ref)
+        if code:
+            parameters.add(code, date_from, raw_value)
+
+    return {
+        'rules': rules,
+        'categories': categories,
+        'parameters': parameters,
+        'input_codes': input_codes,
+    }
+
+
+def prepare_structure(rules, categories, struct_ref=None):
+    """Select the rules of a structure, sort them by sequence and compile their code.
+
+    Every rule gets its category chain (the category code followed by its
+    ancestors) so totals are accumulated like Odoo does.
+    """
+    if struct_ref:
+        rules = [r for r in rules if r['struct_ref'] == struct_ref]
+
+    prepared = []
+    for rule in sorted(rules, key=lambda r: r['sequence']):
+        code = rule['code']
+
+        chain = []
+        ref = rule['category_ref']
+        seen = set()
+        while ref and ref not in seen:
+            seen.add(ref)
+            if ref in categories:
+                cat_code, parent_ref = categories[ref]
+                chain.append(cat_code or _category_code_from_ref(ref))
+                ref = parent_ref
+            else:
+                chain.append(_category_code_from_ref(ref))
+                ref = None
+
+        compiled = dict(rule, category_chain=tuple(chain))
+        compiled['quantity_code'] = compile_rule_code(rule['quantity'], 'eval', code)
+        if rule['condition_select'] == 'python':
+            compiled['condition_code'] = compile_rule_code(
+                rule['condition_python'] or 'result = True', 'exec', code)
+        elif rule['condition_select'] == 'range':
+            compiled['condition_code'] = compile_rule_code(rule['condition_range'], 'eval', code)
+        if rule['amount_select'] == 'code':
+            compiled['amount_code'] = compile_rule_code(
+                rule['amount_python_compute'] or 'result = 0.0', 'exec', code)
+        elif rule['amount_select'] == 'percentage':
+            compiled['amount_code'] = compile_rule_code(
+                rule['amount_percentage_base'] or '0.0', 'eval', code)
+        prepared.append(compiled)
+    return prepared
+
+
+def load_employees_csv(path):
+    """Load employees from a CSV file.
+
+    Columns named input_<CODE> become payslip inputs; every other column is
+    available as an attribute of both `employee` and `contract` (numeric
+    values are converted to float).
+    """
+    employees = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            attrs = {}
+            inputs = {}
+            for column, value in row.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    pass
+                if column.startswith('input_'):
+                    inputs[column[len('input_'):]] = value
+                else:
+                    attrs[column] = value
+            employees.append((attrs, inputs))
+    return employees
+
+
+def generate_employees(count, wage_min, wage_max, seed=None):
+    """Generate synthetic employees with a random wage."""
+    rng = random.Random(seed)
+    return [
+        ({'name': f"EMP{i:05d}", 'wage': round(rng.uniform(wage_min, wage_max), 2)}, {})
+        for i in range(1, count + 1)
+    ]
+
+
+def _base_localdict(attrs, inputs, payslip):
+    person = AttrDict(attrs)
+    return {
+        '__builtins__': SAFE_BUILTINS,
+        'employee': person,
+        'contract': person,
+        'payslip': payslip,
+        'rule_parameter': payslip.rule_parameter,
+        'categories': Totals(),
+        'rules': RuleTotals(),
+        'inputs': AttrDict((code, AttrDict(code=code, amount=amount))
+                           for code, amount in inputs.items()),
+        'worked_days': AttrDict(),
+    }
+
+
+def _apply_rule_total(localdict, rule, amount, qty, rate):
+    """Store a rule result in the localdict and add it to its category chain."""
+    total = amount * qty * rate / 100.0
+    code = rule['code']
+    previous = localdict.get(code, 0.0)
+    localdict[code] = total
+    localdict['rules'][code] = AttrDict(total=total, amount=amount, quantity=qty, rate=rate)
+    categories = localdict['categories']
+    for cat_code in rule['category_chain']:
+        categories[cat_code] = categories[cat_code] + total - previous
+    return total
+
+
+def evaluate_rule(localdict, rule):
+    """Evaluate a compiled rule for one employee.
+
+    Returns:
+        tuple: (amount, quantity, rate), or None if the condition is not met.
+    """
+    localdict['result'] = None
+    localdict['result_qty'] = 1.0
+    localdict['result_rate'] = 100.0
+    localdict['result_name'] = False
+
+    condition = rule['condition_select']
+    if condition == 'python':
+        exec(rule['condition_code'], localdict)
+        if not localdict.get('result'):
+            return None
+    elif condition == 'range':
+        value = eval(rule['condition_code'], localdict)
+        if not rule['condition_range_min'] <= value <= rule['condition_range_max']:
+            return None
+
+    amount_select = rule['amount_select']
+    if amount_select == 'code':
+        localdict['result'] = None
+        exec(rule['amount_code'], localdict)
+        return (float(localdict['result'] or 0.0),
+                float(localdict.get('result_qty', 1.0)),
+                float(localdict.get('result_rate', 100.0)))
+
+    qty = float(eval(rule['quantity_code'], localdict))
+    if amount_select == 'percentage':
+        base = float(eval(rule['amount_code'], localdict))
+        return base, qty, rule['amount_percentage']
+    return rule['amount_fix'], qty, 100.0
+
+
+def simulate(rules, employees, payslip):
+    """Evaluate the structure for every employee, one employee at a time.
+
+    Returns:
+        tuple: (results, errors) where results is a list of {rule code: total}
+               per employee and errors a list of (employee, rule code, message).
+    """
+    results = []
+    errors = []
+    for attrs, inputs in employees:
+        localdict = _base_localdict(attrs, inputs, payslip)
+        totals = {}
+        for rule in rules:
+            try:
+                computed = evaluate_rule(localdict, rule)
+            except Exception as e:
+                errors.append((attrs.get('name', ''), rule['code'], str(e)))
+                continue
+            if computed is not None:
+                totals[rule['code']] = _apply_rule_total(localdict, rule, *computed)
+        results.append(totals)
+    return results, errors
+
+
+def _is_vectorizable(rule):
+    return (rule['condition_select'] in ('none', 'range')
+            and rule['amount_select'] in ('fix', 'percentage'))
+
+
+def simulate_vectorized(rules, employees, payslip):
+    """Evaluate the structure rule by rule over the whole batch with numpy.
+
+    Rules with fix/percentage amounts (and no python condition) are computed
+    as array operations: their base, quantity and range expressions are
+    evaluated once against columns of employee values. Any other rule, or a
+    rule whose expressions cannot be evaluated on arrays, falls back to the
+    per-employee evaluation; the per-employee localdicts are rebuilt from the
+    column totals only when such a rule follows a vectorized one.
+    """
+    if numpy is None:
+        raise RuntimeError("numpy is required for --vectorize (pip install numpy)")
+
+    count = len(employees)
+    zeros = numpy.zeros(count)
+
+    # Columnas de atributos numéricos para contract/employee
+    columns = AttrDict()
+    for attrs, _inputs in employees:
+        for key in attrs:
+            if key not in columns:
+                try:
+                    columns[key] = numpy.array([float(a.get(key, 0.0)) for a, _i in employees])
+                except (TypeError, ValueError):
+                    columns[key] = None
+    columns = AttrDict((key, col) for key, col in columns.items() if col is not None)
+
+    vector_categories = Totals()
+    vector_rules = RuleTotals()
+    vector_ctx = {
+        '__builtins__': SAFE_BUILTINS,
+        'employee': columns,
+        'contract': columns,
+        'payslip': payslip,
+        'rule_parameter': payslip.rule_parameter,
+        'categories': vector_categories,
+        'rules': vector_rules,
+        'inputs': AttrDict(),
+        'worked_days': AttrDict(),
+    }
+    applied_masks = {}
+    errors = []
+    localdicts = None
+
+    def materialize():
+        """Build per-employee localdicts from the column totals."""
+        cat_values = {c: arr.tolist() for c, arr in vector_categories.items()}
+        rule_values = {c: (r.total.tolist(), r.amount.tolist(), r.quantity.tolist(), r.rate.tolist())
+                       for c, r in vector_rules.items()}
+        built = []
+        for i, (attrs, inputs) in enumerate(employees):
+            localdict = _base_localdict(attrs, inputs, payslip)
+            categories = localdict['categories']
+            for cat_code, values in cat_values.items():
+                categories[cat_code] = values[i]
+            for code, (total, amount, qty, rate) in rule_values.items():
+                if applied_masks[code][i]:
+                    localdict[code] = total[i]
+                    localdict['rules'][code] = AttrDict(total=total[i], amount=amount[i],
+                                                        quantity=qty[i], rate=rate[i])
+            built.append(localdict)
+        return built
+
+    for rule in rules:
+        code = rule['code']
+        vectorized = False
+        if _is_vectorizable(rule):
+            try:
+                mask = numpy.ones(count, dtype=bool)
+                if rule['condition_select'] == 'range':
+                    value = eval(rule['condition_code'], vector_ctx) + zeros
+                    mask = (rule['condition_range_min'] <= value) & (value <= rule['condition_range_max'])
+                qty = eval(rule['quantity_code'], vector_ctx) + zeros
+                if rule['amount_select'] == 'percentage':
+                    amount = eval(rule['amount_code'], vector_ctx) + zeros
+                    rate = rule['amount_percentage'] + zeros
+                else:
+                    amount = rule['amount_fix'] + zeros
+                    rate = 100.0 + zeros
+                totals = numpy.where(mask, amount * qty * rate / 100.0, 0.0)
+                vectorized = True
+                localdicts = None
+            except Exception:
+                pass
+
+        if not vectorized:
+            # Evaluación por empleado para esta regla
+            if localdicts is None:
+                localdicts = materialize()
+            mask = numpy.zeros(count, dtype=bool)
+            totals, amount, qty, rate = (numpy.zeros(count) for _ in range(4))
+            for i, localdict in enumerate(localdicts):
+                try:
+                    computed = evaluate_rule(localdict, rule)
+                except Exception as e:
+                    errors.append((employees[i][0].get('name', ''), code, str(e)))
+                    continue
+                if computed is not None:
+                    totals[i] = _apply_rule_total(localdict, rule, *computed)
+                    amount[i], qty[i], rate[i] = computed
+                    mask[i] = True
+
+        applied_masks[code] = mask
+        vector_ctx[code] = totals
+        vector_rules[code] = AttrDict(total=totals, amount=amount, quantity=qty, rate=rate)
+        for cat_code in rule['category_chain']:
+            vector_categories[cat_code] = vector_categories.get(cat_code, zeros) + totals
+
+    results = [{} for _ in range(count)]
+    for code, mask in applied_masks.items():
+        totals = vector_rules[code].total.tolist()
+        for i in numpy.flatnonzero(mask).tolist():
+            results[i][code] = totals[i]
+    return results, errors
+
+
+def write_results_csv(path, employees, rule_codes, results):
+    """Write one row per employee with the total of every rule."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['employee'] + rule_codes)
+        for (attrs, _inputs), totals in zip(employees, results):
+            writer.writerow([attrs.get('name', '')] +
+                            [round(totals.get(code, 0.0), 2) for code in rule_codes])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulate exported Odoo payroll rules offline for a batch of employees'
+    )
+    parser.add_argument('--xml', required=True,
+                       help='XML file generated by odoo_payroll_extractor_improved.py')
+    parser.add_argument('--structure', default=None,
+                       help='struct_id ref of the structure to simulate (required if the file has several)')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--employees', help='CSV file with one employee per row (wage, input_<CODE>, ...)')
+    group.add_argument('--synthetic', type=int, help='Number of synthetic employees to generate')
+    parser.add_argument('--wage-min', type=float, default=20000.0,
+                       help='Minimum wage for synthetic employees (default: 20000)')
+    parser.add_argument('--wage-max', type=float, default=150000.0,
+                       help='Maximum wage for synthetic employees (default: 150000)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for synthetic employees')
+    parser.add_argument('--date', default=date.today().isoformat(),
+                       help='Payslip date used for rule parameter lookups (default: today)')
+    parser.add_argument('--output', default=None, help='CSV file with the totals per employee and rule')
+    parser.add_argument('--vectorize', action='store_true',
+                       help='Compute fix/percentage rules as numpy array operations')
+
+    args = parser.parse_args()
+
+    print(f"Loading rules from {args.xml}...")
+    data = load_exported_xml(args.xml)
+
+    struct_refs = sorted({r['struct_ref'] for r in data['rules'] if r['struct_ref']})
+    struct_ref = args.structure
+    if not struct_ref and len(struct_refs) > 1:
+        print("Error: the file contains several structures, use --structure:", file=sys.stderr)
+        for ref in struct_refs:
+            print(f"  {ref}", file=sys.stderr)
+        sys.exit(1)
+
+    rules = prepare_structure(data['rules'], data['categories'], struct_ref)
+    if not rules:
+        print("No rules found for the specified structure.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Compiled {len(rules)} rules ({len(_CODE_CACHE)} distinct code objects), "
+          f"{len(data['parameters'])} rule parameters")
+
+    if args.employees:
+        employees = load_employees_csv(args.employees)
+    else:
+        employees = generate_employees(args.synthetic, args.wage_min, args.wage_max, args.seed)
+
+    payslip = Payslip(args.date, args.date, data['parameters'])
+
+    print(f"Simulating {len(employees)} employees...")
+    start = time.perf_counter()
+    try:
+        if args.vectorize:
+            results, errors = simulate_vectorized(rules, employees, payslip)
+        else:
+            results, errors = simulate(rules, employees, payslip)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    rule_codes = [r['code'] for r in rules]
+    if args.output:
+        write_results_csv(args.output, employees, rule_codes, results)
+
+    print(f"\n{'='*70}")
+    print("RESULTADO DE LA SIMULACION")
+    print(f"{'='*70}")
+    print(f"Empleados simulados: {len(employees)}")
+    print(f"Reglas evaluadas: {len(rules)}")
+    print(f"Tiempo: {elapsed:.3f}s ({len(employees) / elapsed if elapsed else 0:.0f} empleados/s)")
+    if args.output:
+        print(f"Resultados exportados a: {args.output}")
+
+    print(f"\n{'Codigo':<20} {'Aplicada':>10} {'Total':>18}")
+    print(f"{'-'*70}")
+    for code in rule_codes:
+        applied = sum(1 for totals in results if code in totals)
+        total = sum(totals.get(code, 0.0) for totals in results)
+        print(f"{code:<20} {applied:>10} {total:>18,.2f}")
+
+    if errors:
+        print(f"\n{'='*70}")
+        print(f"ERRORES DE EVALUACION: {len(errors)}")
+        print(f"{'='*70}")
+        for employee, code, message in errors[:20]:
+            print(f"{employee:<12} {code:<20} {message}")
+        if len(errors) > 20:
+            print(f"... y {len(errors) - 20} mas")
+    print(f"{'='*70}")
+
+
+if __name__ == '__main__':
+    main()